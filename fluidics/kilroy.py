@@ -19,7 +19,7 @@ import os
 import time
 from PyQt4 import QtCore, QtGui
 from .valves.valveChain import ValveChain
-from .pumps.pumpControl import PumpControl
+from .pumps.pumpBank import PumpBank
 from .kilroyProtocols import KilroyProtocols
 from sc_library.tcpServer import TCPServer
 import sc_library.parameters as params
@@ -34,9 +34,12 @@ class Kilroy(QtGui.QMainWindow):
         # Parse parameters into internal attributes
         self.verbose = parameters.get("verbose")
         self.valve_com_port = parameters.get("valves_com_port")
+        if isinstance(self.valve_com_port, basestring) and ("," in self.valve_com_port):
+            # Several valve chains, e.g. "3,4": valves are numbered in chain order
+            self.valve_com_port = [int(port) if port.strip().isdigit() else port.strip()
+                                   for port in self.valve_com_port.split(",")]
         self.tcp_port = parameters.get("tcp_port")
         self.pump_com_port = parameters.get("pump_com_port")
-        self.pump_ID = parameters.get("pump_ID")
         if not "num_simulated_valves" in parameters.parameters:
             self.num_simulated_valves = 0
         else:
@@ -61,7 +64,43 @@ class Kilroy(QtGui.QMainWindow):
 
         if "simulate_cnc" in parameters.parameters and parameters.get("simulate_cnc"):
             self.usb_cnc = "simulated"
+
+        # The detected valve chain topology is cached next to the settings file
+        if not "valve_topology_file" in parameters.parameters:
+            self.valve_topology_file = os.path.splitext(parameters.get("parameters_file"))[0] + "_valves.json"
+        else:
+            self.valve_topology_file = parameters.get("valve_topology_file")
+
+        # Valves that must always rotate in a fixed direction, e.g. "0,,1" (0 = clockwise,
+        # 1 = counter clockwise, empty = shortest path)
+        self.valve_direction_overrides = {}
+        if "valve_directions" in parameters.parameters:
+            for [valve_ID, direction] in enumerate(str(parameters.get("valve_directions")).split(",")):
+                if direction.strip() in ("0", "1"):
+                    self.valve_direction_overrides[valve_ID] = int(direction)
+
+        # Measured valve and CNC move times are also kept next to the settings file
+        if not "move_model_file" in parameters.parameters:
+            self.move_model_file = os.path.splitext(parameters.get("parameters_file"))[0] + "_move_times.json"
+        else:
+            self.move_model_file = parameters.get("move_model_file")
+
+        # The interpolated CNC well positions are cached there too
+        if not "cnc_well_cache_file" in parameters.parameters:
+            self.cnc_well_cache_file = os.path.splitext(parameters.get("parameters_file"))[0] + "_wells.json"
+        else:
+            self.cnc_well_cache_file = parameters.get("cnc_well_cache_file")
             
+        # Valve status poll intervals (ms): fast while valves move, slow when idle
+        if not "valve_poll_time" in parameters.parameters:
+            self.valve_poll_time = 2000
+        else:
+            self.valve_poll_time = parameters.get("valve_poll_time")
+        if not "valve_fast_poll_time" in parameters.parameters:
+            self.valve_fast_poll_time = 100
+        else:
+            self.valve_fast_poll_time = parameters.get("valve_fast_poll_time")
+
         # Define additional internal attributes
         self.received_message = None
         
@@ -69,19 +108,32 @@ class Kilroy(QtGui.QMainWindow):
         self.valveChain = ValveChain(com_port = self.valve_com_port,
                                      num_simulated_valves = self.num_simulated_valves,
                                      usb_cnc = self.usb_cnc,
+                                     topology_file = self.valve_topology_file,
+                                     move_model_file = self.move_model_file,
+                                     well_cache_file = self.cnc_well_cache_file,
+                                     direction_overrides = self.valve_direction_overrides,
+                                     poll_time = self.valve_poll_time,
+                                     fast_poll_time = self.valve_fast_poll_time,
                                      verbose = self.verbose)
 
-        # Create PumpControl instance
-        self.pumpControl = PumpControl(parameters = parameters)
+        # Create PumpBank instance: one PumpControl per pump
+        self.pumpBank = PumpBank(parameters = parameters)
                                        
         # Create KilroyProtocols instance and connect signals
+        if self.valveChain.cnc is not None:
+            cnc_travel_time = self.valveChain.estimateCNCTravelTime
+        else:
+            cnc_travel_time = None
         self.kilroyProtocols = KilroyProtocols(protocol_xml_path = self.protocols_file,
                                                command_xml_path = self.commands_file,
+                                               cnc_travel_time = cnc_travel_time,
+                                               num_pumps = self.pumpBank.howManyPumps(),
                                                verbose = self.verbose)
 
         self.kilroyProtocols.command_ready_signal.connect(self.sendCommand)
         self.kilroyProtocols.status_change_signal.connect(self.handleProtocolStatusChange)
         self.kilroyProtocols.completed_protocol_signal.connect(self.handleProtocolComplete)
+        self.valveChain.cnc_move_done_signal.connect(self.kilroyProtocols.releaseCommand)
 
         # Create Kilroy TCP Server and connect signals
         self.tcpServer = TCPServer(port = self.tcp_port,
@@ -100,7 +152,7 @@ class Kilroy(QtGui.QMainWindow):
         self.kilroyProtocols.close()
         self.tcpServer.close()
         self.valveChain.close()
-        self.pumpControl.close()
+        self.pumpBank.close()
         print("\nKilroy was here!")
 
     # ----------------------------------------------------------------------------------------
@@ -112,7 +164,7 @@ class Kilroy(QtGui.QMainWindow):
         self.mainLayout.addWidget(self.kilroyProtocols.valveCommands.mainWidget, 2, 0, 1, 1)
         self.mainLayout.addWidget(self.kilroyProtocols.pumpCommands.mainWidget, 2, 1, 1, 1)
         self.mainLayout.addWidget(self.valveChain.mainWidget, 0, 2, 2, 2)
-        self.mainLayout.addWidget(self.pumpControl.mainWidget, 0, 4, 2, 1)
+        self.mainLayout.addWidget(self.pumpBank.mainWidget, 0, 4, 2, 1)
         #self.mainLayout.addWidget(self.tcpServer.mainWidget, 2, 2, 1, 4)
 
     # ----------------------------------------------------------------------------------------
@@ -122,17 +174,24 @@ class Kilroy(QtGui.QMainWindow):
         status = self.kilroyProtocols.getStatus()
         if status[0] >= 0: # Protocol is running
             self.valveChain.setEnabled(False)
-            self.pumpControl.setEnabled(False)
+            self.pumpBank.setEnabled(False)
+            self.valveChain.resetMoveSavings()
         else:
             self.valveChain.setEnabled(True)
-            self.pumpControl.setEnabled(True)
+            self.pumpBank.setEnabled(True)
 
     # ----------------------------------------------------------------------------------------
     # Handle a protocol complete signal from the valve protocols
     # ----------------------------------------------------------------------------------------
     def handleProtocolComplete(self, message):
+        [skipped_moves, saved_round_trips] = self.valveChain.getMoveSavings()
+        if self.verbose:
+            print "Skipped " + str(skipped_moves) + " redundant valve moves (" + str(saved_round_trips) + " serial round trips saved)"
+
         # If the protocol was sent by TCP pass on the complete signal
         if (self.received_message is not None) and self.received_message.getID() == message.getID():
+            message.addResponse("skipped_valve_moves", skipped_moves)
+            message.addResponse("skipped_valve_round_trips", saved_round_trips)
             self.tcpServer.sendMessage(message)
             self.received_message = None # Reset the received_message
 
@@ -148,8 +207,12 @@ class Kilroy(QtGui.QMainWindow):
             message.setError(True, "Invalid Kilroy Protocol")
             self.tcpServer.sendMessage(message)
         elif message.isTest():
-            required_time = self.kilroyProtocols.requiredTime(message.getData("name"))
+            # Estimate the wall time including measured valve and CNC move times
+            steps = self.kilroyProtocols.getProtocolSteps(message.getData("name"))
+            [required_time, min_time, max_time] = self.valveChain.estimateProtocolTime(steps)
             message.addResponse("duration", required_time)
+            message.addResponse("duration_min", min_time)
+            message.addResponse("duration_max", max_time)
             self.tcpServer.sendMessage(message)
         else: # Valid, non-test message                                    
             # Keep track of valid messages issued via TCP 
@@ -164,8 +227,10 @@ class Kilroy(QtGui.QMainWindow):
         command_data = self.kilroyProtocols.getCurrentCommand()
         if command_data[0] == "valve":
             self.valveChain.receiveCommand(command_data[1])
+            if self.valveChain.isCNCMoving(): # Start the command duration once the CNC arrives
+                self.kilroyProtocols.holdCommand()
         elif command_data[0] == "pump":
-            self.pumpControl.receiveCommand(command_data[1])
+            self.pumpBank.receiveCommand(command_data[1])
         else:
             print("Received command of unknown type: " + str(command_data[0]))
 
@@ -19,6 +19,7 @@ import xml.etree.ElementTree as elementTree
 from PyQt4 import QtCore, QtGui
 from valves.valveCommands import ValveCommands
 from pumps.pumpCommands import PumpCommands
+from valves.well_order import plan_visit_order
 
 # ----------------------------------------------------------------------------------------
 # KilroyProtocols Class Definition
@@ -33,6 +34,8 @@ class KilroyProtocols(QtGui.QMainWindow):
     def __init__(self,
                  protocol_xml_path = "yuxi_config.xml",
                  command_xml_path = "yuxi_config.xml",
+                 cnc_travel_time = None,
+                 num_pumps = None,
                  verbose = False):
         super(KilroyProtocols, self).__init__()
 
@@ -44,9 +47,12 @@ class KilroyProtocols(QtGui.QMainWindow):
         self.protocol_commands = [] # [Instrument Type, command_info]
         self.protocol_durations = []
         self.num_protocols = 0
+        self.cnc_travel_time = cnc_travel_time # function (target, target) -> s, used to plan CNC visits
         self.status = [-1, -1] # Protocol ID, command ID within protocol
         self.issued_command = []
         self.received_message = None
+        self.command_on_hold = False # True while the issued command is still executing
+        self.held_duration = None
 
         print "----------------------------------------------------------------------"
         
@@ -59,6 +65,7 @@ class KilroyProtocols(QtGui.QMainWindow):
 
         # Create instance of PumpCommands class
         self.pumpCommands = PumpCommands(xml_file_path = self.command_xml_path,
+                                         num_pumps = num_pumps,
                                          verbose = self.verbose)
 
         # Connect pump commands issue signal
@@ -194,12 +201,36 @@ class KilroyProtocols(QtGui.QMainWindow):
             print "Did not find " + command_name
             return [-1]*self.num_valves # Return no change command
 
+    # ------------------------------------------------------------------------------------
+    # Return the resolved commands of a protocol: [command_type, command_data, duration]
+    # ------------------------------------------------------------------------------------                                        
+    def getProtocolSteps(self, protocol_name):
+        protocol_ID = self.protocol_names.index(protocol_name)
+        steps = []
+        for [command, duration] in zip(self.protocol_commands[protocol_ID],
+                                       self.protocol_durations[protocol_ID]):
+            if command[0] == "pump":
+                command_data = self.pumpCommands.getCommandByName(command[1])
+            elif command[0] == "valve":
+                command_data = self.valveCommands.getCommandByName(command[1])
+            else:
+                command_data = None
+            steps.append([command[0], command_data, duration])
+        return steps
+
     # ------------------------------------------------------------------------------------
     # Return loaded protocol names
     # ------------------------------------------------------------------------------------                                        
     def getProtocolNames(self):
         return self.protocol_names
 
+    # ------------------------------------------------------------------------------------
+    # Hold the duration of the issued command until releaseCommand is called: called by
+    # command_ready_signal handlers whose command (e.g. a CNC move) runs asynchronously
+    # ------------------------------------------------------------------------------------
+    def holdCommand(self):
+        self.command_on_hold = True
+
     # ------------------------------------------------------------------------------------
     # Issue a command: load current command, send command ready signal
     # ------------------------------------------------------------------------------------                       
@@ -214,10 +245,15 @@ class KilroyProtocols(QtGui.QMainWindow):
                 text += ": " + str(command_duration) + " s"
             print text
             
+        self.command_on_hold = False
+        self.held_duration = None
         self.command_ready_signal.emit()
 
         if command_duration >= 0:
-            self.protocol_timer.start(command_duration*1000)
+            if self.command_on_hold:
+                self.held_duration = command_duration
+            else:
+                self.protocol_timer.start(command_duration*1000)
 
     # ------------------------------------------------------------------------------------
     # Handle Issue Command Request from Pump Commands
@@ -304,6 +340,66 @@ class KilroyProtocols(QtGui.QMainWindow):
         if self.verbose:
             self.printProtocols()
 
+    # ------------------------------------------------------------------------------------
+    # Reorder the CNC visits of a protocol whose visit order is not constrained. The
+    # protocol is split into segments, each starting with a valve command that moves
+    # the CNC and running until the next one. Only runs of consecutive segments that
+    # hold nothing but their CNC move are reordered to minimise CNC travel; a segment
+    # with pump or other valve steps after its move stays in place (as does everything
+    # before the first CNC move), so washes and incubations are never regrouped.
+    # ------------------------------------------------------------------------------------
+    def optimizeCNCOrder(self, protocol_name, commands, durations):
+        if self.cnc_travel_time is None:
+            return [commands, durations]
+
+        # Split the protocol into a fixed prefix and segments that each start with a CNC move
+        prefix = []
+        segments = []
+        targets = []
+        for [command, duration] in zip(commands, durations):
+            target = None
+            if command[0] == "valve":
+                command_data = self.valveCommands.getCommandByName(command[1])
+                if len(command_data) > 0 and isinstance(command_data[-1], tuple):
+                    target = command_data[-1]
+            if target is not None:
+                segments.append([])
+                targets.append(target)
+            if len(segments) == 0:
+                prefix.append([command, duration])
+            else:
+                segments[-1].append([command, duration])
+
+        # Reorder each run of CNC-only segments, starting from the CNC target before it
+        order = []
+        run = []
+        original_time = 0.0
+        planned_time = 0.0
+        for index in range(len(segments) + 1):
+            if (index < len(segments)) and (len(segments[index]) == 1):
+                run.append(index)
+                continue
+            if len(run) > 0:
+                start = targets[run[0] - 1] if run[0] > 0 else None
+                try:
+                    [run_order, run_original_time, run_planned_time] = plan_visit_order([targets[i] for i in run],
+                                                                                        self.cnc_travel_time,
+                                                                                        start)
+                except ValueError as error:
+                    print "Could not plan CNC visits for " + protocol_name + ": " + str(error)
+                    return [commands, durations]
+                order += [run[i] for i in run_order]
+                original_time += run_original_time
+                planned_time += run_planned_time
+                run = []
+            if index < len(segments):
+                order.append(index)
+
+        if self.verbose or (planned_time < original_time):
+            print "Planned CNC visits for " + protocol_name + ": saves " + "%0.1f" % (original_time - planned_time) + " s of travel"
+        steps = prefix + [step for index in order for step in segments[index]]
+        return [[step[0] for step in steps], [step[1] for step in steps]]
+
     # ------------------------------------------------------------------------------------
     # Parse loaded xml file: load protocols
     # ------------------------------------------------------------------------------------                                        
@@ -334,6 +430,10 @@ class KilroyProtocols(QtGui.QMainWindow):
                     new_protocol_commands.append([command.tag,command.text]) # [Instrument Type, Command Name]
                     if (not (command.tag == "pump")) and (not (command.tag == "valve")):
                         print "Unknown command tag: " + command.tag
+                if protocol.get("optimize_cnc_order", "False") == "True":
+                    [new_protocol_commands, new_protocol_durations] = self.optimizeCNCOrder(protocol.get("name"),
+                                                                                             new_protocol_commands,
+                                                                                             new_protocol_durations)
                 self.protocol_commands.append(new_protocol_commands)
                 self.protocol_durations.append(new_protocol_durations)
 
@@ -362,6 +462,16 @@ class KilroyProtocols(QtGui.QMainWindow):
 
         return total_time
         
+    # ------------------------------------------------------------------------------------
+    # Start the duration of a held command once it has finished executing
+    # ------------------------------------------------------------------------------------
+    def releaseCommand(self):
+        if self.command_on_hold:
+            self.command_on_hold = False
+            if (self.held_duration is not None) and self.isRunningProtocol():
+                self.protocol_timer.start(self.held_duration*1000)
+            self.held_duration = None
+
     # ------------------------------------------------------------------------------------
     # Initialize and start a protocol and issue first command
     # ------------------------------------------------------------------------------------
@@ -459,6 +569,8 @@ class KilroyProtocols(QtGui.QMainWindow):
         self.status = [-1,-1]
         self.status_change_signal.emit()
         self.received_message = None
+        self.command_on_hold = False
+        self.held_duration = None
         
         # Stop timer
         self.protocol_timer.stop()
@@ -12,6 +12,8 @@
 # ----------------------------------------------------------------------------------------
 import serial
 import time
+from sc_library.latencyHistogram import LatencyHistogram
+from pumpInterface import AbstractPump, PumpStatus
 
 acknowledge = '\x06'
 start = '\x0A'
@@ -20,7 +22,11 @@ stop = '\x0D'
 # ----------------------------------------------------------------------------------------
 # GlisonMP3 Class Definition
 # ----------------------------------------------------------------------------------------
-class APump():
+class APump(AbstractPump):
+
+    # Capabilities
+    reversible = True
+
     def __init__(self,
                  parameters = False):
 
@@ -32,6 +38,8 @@ class APump():
         self.simulate = parameters.get("simulate_pump", True)
         self.serial_verbose = parameters.get("serial_verbose", False)
         self.flip_flow_direction = parameters.get("flip_flow_direction", False)
+        self.max_attempt_number = 3
+        self.latency = LatencyHistogram() # per-operation round trip times
         
         # Create serial port
         self.serial = serial.Serial(port = self.com_port, 
@@ -82,7 +90,7 @@ class APump():
         #print(message)
         speed = float(message[1:len(message) - 1])
 
-        return (status, speed, direction, control, auto_start, "No Error")
+        return PumpStatus(status, speed, direction, control, auto_start, "No Error")
 
     def close(self):
         self.enableRemoteControl(0)
@@ -114,47 +122,66 @@ class APump():
         self.setSpeed(0.0)
         return True
 
+    def getLatencyReport(self):
+        return self.latency.report()
+
+    def commandName(self, command):
+        return "".join([character for character in command if character.isalpha()])
+
+    # Each transaction selects the unit, exchanges exactly the expected bytes (the last
+    # byte of an immediate response has its 0x80 bit set) and disconnects, so no read
+    # ever waits out the serial timeout unless the pump fails to answer.
     def sendImmediate(self, unitNumber, command):
-        self.selectUnit(unitNumber)
-        self.sendString(command[0])
-        newCharacter = self.getResponse()
-        if len(newCharacter) < 1:
-            print 'error connecting to pump!'
+        start_time = time.time()
         response = ""
-        while not (ord(newCharacter) & 0x80):
-            response += newCharacter
-            self.sendString(acknowledge)
+        complete = False
+        if self.selectUnit(unitNumber):
+            self.sendString(command[0])
             newCharacter = self.getResponse()
-
-        response += chr(ord(newCharacter) & ~0x80)
+            while len(newCharacter) == 1 and not (ord(newCharacter) & 0x80):
+                response += newCharacter
+                self.sendString(acknowledge)
+                newCharacter = self.getResponse()
+            if len(newCharacter) == 1:
+                response += chr(ord(newCharacter) & ~0x80)
+                complete = True
+        if not complete:
+            print 'error connecting to pump!'
         self.disconnect()
+        self.latency.record("immediate " + command[0], time.time() - start_time, timed_out = not complete)
 
         return response
 
     def sendBuffered(self, unitNumber, command):
-        self.selectUnit(unitNumber)
-        self.sendAndAcknowledge(start + command + stop)
-        self.disconnect()
+        start_time = time.time()
+        complete = False
+        for attempt in range(self.max_attempt_number):
+            if self.selectUnit(unitNumber) and self.sendAndAcknowledge(start + command + stop):
+                complete = True
+                break
+        if not complete:
+            print 'error sending ' + command + ' to pump!'
+        self.disconnect() # once, after the last attempt: selecting a unit again needs no disconnect
+        self.latency.record("buffered " + self.commandName(command), time.time() - start_time, timed_out = not complete)
+        return complete
 
     def disconnect(self):
-        self.sendAndAcknowledge('\xff')
+        self.sendString('\xff') # all units disconnect, none of them answers
 
     def selectUnit(self, unitNumber):
         devSelect = chr(0x80 | unitNumber)
+        self.serial.flushInput() # Discard any late bytes from a previous transaction
         self.sendString(devSelect) 
 
         return self.getResponse() == devSelect
 
     def sendAndAcknowledge(self, string):
-        for i in range(0, len(string)):
-            self.sendString(string[i])
-            self.getResponse()
+        # The pump echoes every byte of a buffered command: write it at once and check the echo as a block
+        self.sendString(string)
+        return self.getResponse(len(string)) == string
 
     def sendString(self, string):
         self.serial.write(string)
 
-    def getResponse(self):
-        return self.serial.readline()# changed from serial.read() to readline(). -Yuxi 20190725
-
-
-
+    def getResponse(self, num_bytes = 1):
+        return self.serial.read(num_bytes)
@@ -14,6 +14,7 @@ import serial
 import time
 import tic
 import constants
+from pumpInterface import AbstractPump, PumpStatus
 
 acknowledge = '\x06'
 start = '\x0A'
@@ -22,7 +23,11 @@ stop = '\x0D'
 # ----------------------------------------------------------------------------------------
 # TIC Class Definition
 # ----------------------------------------------------------------------------------------
-class APump():
+class APump(AbstractPump):
+
+    # Capabilities
+    reversible = True
+
     def __init__(self,
                  parameters = False):
 
@@ -65,12 +70,12 @@ class APump():
         return self.sendImmediate(self.pump_ID, "R")
 
     def getStatus(self):
-        v = self.tic.get_variables()
+        v = self.tic.get_variables(names = ("current_velocity",))
 
         status = "Stopped" if v["current_velocity"] == 0 else "Flowing"
         speed = v["current_velocity"]/(40000.)
         direction = "Forward" if self.direction > 0 else "Reverse"
-        return (status, speed, direction, "K", "Disabled", "No Error")
+        return PumpStatus(status, speed, direction, "K", "Disabled", "No Error")
 
     def close(self):
         self.tic.close()
@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# ----------------------------------------------------------------------------------------
+# pumpBank: A set of independent pumps (e.g. one per flow line), each with its own
+# PumpControl. The pump settings (pump_class, pump_com_port, pump_ID, ...) hold one
+# comma separated value per pump, e.g. "3,4"; a single value applies to every pump.
+# The pump_ID setting is the unit address of each pump on its serial line; pump commands
+# address the pumps by their position in the bank instead (pump_index = 1, 2, ...).
+# ----------------------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------------------
+# Import
+# ----------------------------------------------------------------------------------------
+from PyQt4 import QtGui
+from pumpControl import PumpControl
+
+# Settings that may hold one value per pump
+pump_settings = ("pump_class", "pump_com_port", "pump_ID", "simulate_pump", "flip_flow_direction")
+
+# ----------------------------------------------------------------------------------------
+# Determine the number of pumps from the per pump settings
+# ----------------------------------------------------------------------------------------
+def countPumps(parameters):
+    num_pumps = 1
+    for name in pump_settings:
+        if name in parameters.parameters:
+            value = parameters.get(name)
+            if isinstance(value, basestring):
+                num_pumps = max(num_pumps, len(value.split(",")))
+    return num_pumps
+
+# ----------------------------------------------------------------------------------------
+# PumpParameters Class Definition: the settings seen by one pump of the bank
+# ----------------------------------------------------------------------------------------
+class PumpParameters(object):
+    def __init__(self,
+                 parameters = False,
+                 pump_index = 0):
+
+        # Define local attributes
+        self.bank_parameters = parameters
+        self.parameters = parameters.parameters
+        self.pump_index = pump_index
+
+    # ------------------------------------------------------------------------------------
+    # Return the value of a setting for this pump
+    # ------------------------------------------------------------------------------------
+    def get(self, name, default = None):
+        value = self.bank_parameters.get(name, default)
+        if (name in pump_settings) and isinstance(value, basestring) and ("," in value):
+            values = [entry.strip() for entry in value.split(",")]
+            value = values[min(self.pump_index, len(values) - 1)]
+            if value.isdigit() and (value == "0" or not value.startswith("0")): # keep serial numbers such as "0012" as strings
+                value = int(value)
+            elif value in ("True", "False"):
+                value = (value == "True")
+        return value
+
+# ----------------------------------------------------------------------------------------
+# PumpBank Class Definition
+# ----------------------------------------------------------------------------------------
+class PumpBank(QtGui.QWidget):
+    def __init__(self,
+                 parameters = False,
+                 parent = None):
+
+        # Initialize parent class
+        QtGui.QWidget.__init__(self, parent)
+
+        # Define internal attributes
+        self.verbose = parameters.get("verbose", True)
+        self.num_pumps = countPumps(parameters)
+
+        # Create one PumpControl (and so one pump worker thread) per pump
+        self.pump_controls = []
+        for pump_index in range(self.num_pumps):
+            self.pump_controls.append(PumpControl(parameters = PumpParameters(parameters, pump_index)))
+
+        # Create GUI Elements
+        self.createGUI()
+
+    # ------------------------------------------------------------------------------------
+    # Close all pumps
+    # ------------------------------------------------------------------------------------
+    def close(self):
+        for pump_control in self.pump_controls:
+            pump_control.close()
+
+    # ------------------------------------------------------------------------------------
+    # Create GUI Elements
+    # ------------------------------------------------------------------------------------
+    def createGUI(self):
+        if self.num_pumps == 1:
+            self.mainWidget = self.pump_controls[0].mainWidget
+            return
+
+        self.mainWidget = QtGui.QWidget()
+        self.mainWidgetLayout = QtGui.QHBoxLayout(self.mainWidget)
+        for [pump_index, pump_control] in enumerate(self.pump_controls):
+            pump_control.mainWidget.setTitle("Pump " + str(pump_index + 1) + " Controls")
+            self.mainWidgetLayout.addWidget(pump_control.mainWidget)
+
+    # ------------------------------------------------------------------------------------
+    # Determine number of pumps
+    # ------------------------------------------------------------------------------------
+    def howManyPumps(self):
+        return self.num_pumps
+
+    # ------------------------------------------------------------------------------------
+    # Change pumps based on sent command: one [direction, speed] entry per pump, None for
+    # no change. Each pump control only queues its part on its own worker, so all pumps
+    # of a protocol step change at the same time
+    # ------------------------------------------------------------------------------------
+    def receiveCommand(self, command):
+        for [pump_index, pump_command] in enumerate(command):
+            if pump_command is None:
+                continue
+            if pump_index < self.num_pumps:
+                self.pump_controls[pump_index].receiveCommand(pump_command)
+            else:
+                print "Pump " + str(pump_index + 1) + " is not defined"
+
+    # ------------------------------------------------------------------------------------
+    # Determine Enabled State
+    # ------------------------------------------------------------------------------------
+    def setEnabled(self, enabled):
+        for pump_control in self.pump_controls:
+            pump_control.setEnabled(enabled)
+
+#
+# The MIT License
+#
+# Copyright (c) 2013 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
@@ -25,6 +25,7 @@ class PumpCommands(QtGui.QMainWindow):
     
     def __init__(self,
                  xml_file_path="default_config.xml",
+                 num_pumps = None,
                  verbose = False):
         super(PumpCommands, self).__init__()
 
@@ -35,6 +36,7 @@ class PumpCommands(QtGui.QMainWindow):
         self.commands = []
         self.num_commands = 0
         self.num_pumps = 0
+        self.expected_num_pumps = num_pumps # number of configured pumps (None = not checked)
         
         # Create GUI
         self.createGUI()
@@ -48,6 +50,20 @@ class PumpCommands(QtGui.QMainWindow):
     def close(self):
         if self.verbose: print "Closing pump commands"
 
+    # ------------------------------------------------------------------------------------
+    # Describe a command: the direction and speed of each pump it changes
+    # ------------------------------------------------------------------------------------
+    def commandText(self, command, indent = ""):
+        text_string = ""
+        for [pump_index, pump_command] in enumerate(command):
+            if pump_command is None:
+                continue
+            if self.num_pumps > 1:
+                text_string += indent + "Pump " + str(pump_index + 1) + "\n"
+            text_string += indent + "Flow Direction: " + pump_command[0] + "\n"
+            text_string += indent + "Flow Speed: " + str(pump_command[1]) + "\n"
+        return text_string
+
     # ------------------------------------------------------------------------------------
     # Create display and control widgets
     # ------------------------------------------------------------------------------------
@@ -97,7 +113,7 @@ class PumpCommands(QtGui.QMainWindow):
             return self.commands[command_ID]
         except:
             print "Invalvid command index: " + command_ID
-            return [-1]*self.num_valves # return default
+            return [None]*self.num_pumps # return default
 
     # ------------------------------------------------------------------------------------
     # Return a command indexed by its name
@@ -108,7 +124,7 @@ class PumpCommands(QtGui.QMainWindow):
             return self.commands[command_ID]
         except:
             print "Did not find " + command_name
-            return [-1]*self.num_valves # Return no change command
+            return [None]*self.num_pumps # Return no change command
 
     # ------------------------------------------------------------------------------------
     # Return the names of the current defined commands
@@ -157,31 +173,48 @@ class PumpCommands(QtGui.QMainWindow):
             print "Valid xml file not loaded"
             return
 
-        # Clear previous commands
-        self.command_names = []
-        self.commands = []
-        self.num_commands = 0
-
-        # Load number of valves
-        self.num_pumps = int(self.kilroy_configuration.get("num_pumps"))
-        if not (self.num_pumps>0):
+        # Load number of pumps: commands may address fewer pumps than are configured, but
+        # not more. A bad file is reported and the previous commands are kept.
+        num_pumps = int(self.kilroy_configuration.get("num_pumps"))
+        if not (num_pumps>0):
             print "Number of pumps not specified"
-        
-        # Load commands
+        if (self.expected_num_pumps is not None) and (num_pumps > self.expected_num_pumps):
+            print (self.file_name + " defines commands for " + str(num_pumps) + " pumps but only " +
+                   str(self.expected_num_pumps) + " are configured: keeping previous commands")
+            return
+        if self.expected_num_pumps is not None:
+            num_pumps = self.expected_num_pumps # pad commands for the extra pumps with None (no change)
+
+        # Load commands: one [direction, speed] entry per pump (None = no change). The
+        # pump_index of a pump_config is its 1 based position in the pump bank.
+        command_names = []
+        commands = []
         for pump_command in self.kilroy_configuration.findall("pump_commands"):
             command_list = pump_command.findall("pump_cmd")
             for command in command_list:
+                new_command = [None]*num_pumps
                 for pump_config in command.findall("pump_config"):
+                    pump_index = int(pump_config.get("pump_index", 1)) - 1
                     speed = float(pump_config.get("speed"))
                     direction = pump_config.get("direction")
                     if speed < 0.00 or speed > 48.0:
                         speed = 0.0
                         direction = "Stopped" # Flag for stopped flow
                     direction = {"Forward": "Forward", "Reverse": "Reverse"}.get(direction, "Stopped")
+                    if not (0 <= pump_index < num_pumps):
+                        print ("Pump " + str(pump_index + 1) + " of " + command.get("name") +
+                               " is not defined: keeping previous commands")
+                        return
+                    new_command[pump_index] = [direction, speed]
                     
                 # Add command
-                self.commands.append([direction, speed])
-                self.command_names.append(command.get("name"))
+                commands.append(new_command)
+                command_names.append(command.get("name"))
+
+        # Replace previous commands
+        self.command_names = command_names
+        self.commands = commands
+        self.num_pumps = num_pumps
 
         # Record number of configs
         self.num_commands = len(self.command_names)
@@ -193,11 +226,7 @@ class PumpCommands(QtGui.QMainWindow):
         print "Current commands:"
         for command_ID in range(self.num_commands):
             print self.command_names[command_ID]
-            direction = self.commands[command_ID][0]
-            speed = self.commands[command_ID][1]
-            text_string = "    " + "Flow Direction: " + direction + "\n"
-            text_string += "    " + "Speed: " + str(speed) +"\n"
-            print text_string
+            print self.commandText(self.commands[command_ID], "    ")
 
     # ------------------------------------------------------------------------------------
     # Update active command on GUI
@@ -229,8 +258,7 @@ class PumpCommands(QtGui.QMainWindow):
         current_command = self.commands[current_ID]
 
         text_string = current_command_name + "\n"
-        text_string += "Flow Direction: " + current_command[0] + "\n"
-        text_string += "Flow Speed: " + str(current_command[1]) + "\n"
+        text_string += self.commandText(current_command)
         self.currentCommandLabel.setText(text_string)
 
     # ------------------------------------------------------------------------------------
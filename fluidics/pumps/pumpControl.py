@@ -14,11 +14,16 @@ import serial
 import sys
 import time
 from PyQt4 import QtCore, QtGui
+from pumpInterface import PumpWorker
 
 # ----------------------------------------------------------------------------------------
 # PumpControl Class Definition
 # ----------------------------------------------------------------------------------------
 class PumpControl(QtGui.QWidget):
+
+    # Define custom signals
+    status_signal = QtCore.pyqtSignal(object) # PumpStatus, emitted from the pump worker thread
+
     def __init__(self,
                  parameters = False,
                  parent = None):
@@ -41,11 +46,15 @@ class PumpControl(QtGui.QWidget):
                                  [parameters.get("pump_class", "pumps.rainin_rp1")],
                                  -1)
 
-        # Create Instance of Pump
+        # Create Instance of Pump and the worker that performs all of its I/O
         self.pump = pump_module.APump(parameters = parameters)
+        self.pump_worker = PumpWorker(pump = self.pump, verbose = self.verbose)
+        self.capabilities = self.pump_worker.getCapabilities()
+        self.status_request = None
 
         # Create GUI Elements
         self.createGUI()
+        self.status_signal.connect(self.updateStatus)
         self.pollPumpStatus()
         
         # Define timer for periodic polling of pump status
@@ -59,7 +68,8 @@ class PumpControl(QtGui.QWidget):
     # ------------------------------------------------------------------------------------
     def close(self):
         if self.verbose: "Print closing pump"
-        self.pump.close()
+        self.status_timer.stop()
+        self.pump_worker.close()
 
     # ------------------------------------------------------------------------------------
     # Coerce Speed Entry to Acceptable Range
@@ -117,6 +127,7 @@ class PumpControl(QtGui.QWidget):
         self.direction_control = QtGui.QComboBox()
         self.direction_control.addItem("Forward")
         self.direction_control.addItem("Reverse")
+        self.direction_control.setEnabled(self.capabilities["reversible"])
 
         self.start_flow_button = QtGui.QPushButton()
         self.start_flow_button.setText("Start Flow")
@@ -144,47 +155,64 @@ class PumpControl(QtGui.QWidget):
         self.pump_identification_label.setText(self.pump.identification)
         
         # Flow status
-        if status[0] == "Flowing":
-            self.flow_status_display.setText(status[2])
+        if status.flow_status == "Flowing":
+            self.flow_status_display.setText(status.direction)
             self.flow_status_display.setStyleSheet("QLabel { color: green}")
             self.stop_flow_button.setEnabled(True)
             self.start_flow_button.setText("Change Flow")
-        elif status[0] == "Stopped":
-            self.flow_status_display.setText(status[0])
+        elif status.flow_status == "Stopped":
+            self.flow_status_display.setText(status.flow_status)
             self.flow_status_display.setStyleSheet("QLabel { color: red}")
             self.stop_flow_button.setEnabled(False)
             self.start_flow_button.setText("Start Flow")
         else: # Unknown status
-            self.flow_status_display.setText(status[0])
+            self.flow_status_display.setText(status.flow_status)
             self.flow_status_display.setStyleSheet("QLabel { color: red}")
             self.stop_flow_button.setEnabled(False)
             self.start_flow_button.setEnabled(False)
 
         # Speed
-        self.speed_display.setText("%0.2f" % status[1] + " " + self.speed_units)
+        self.speed_display.setText("%0.2f" % status.speed + " " + self.speed_units)
             
     # ----------------------------------------------------------------------------------------
-    # Poll Pump Status
+    # Poll Pump Status: skipped while a previous status request is still pending
     # ----------------------------------------------------------------------------------------
     def pollPumpStatus(self):
-        self.updateStatus(self.pump.getStatus())
+        if self.status_request is None or self.status_request.done():
+            self.requestPumpStatus()
+
+    # ----------------------------------------------------------------------------------------
+    # Request the pump status from the pump worker: the display updates when it arrives
+    # ----------------------------------------------------------------------------------------
+    def requestPumpStatus(self):
+        self.status_request = self.pump_worker.getStatus()
+        self.status_request.addDoneCallback(self.handleStatusDone)
+
+    # ----------------------------------------------------------------------------------------
+    # Handle a completed status request (called in the pump worker thread)
+    # ----------------------------------------------------------------------------------------
+    def handleStatusDone(self, future):
+        if future.exception() is None:
+            self.status_signal.emit(future.result())
+        else:
+            print "Could not read pump status: " + str(future.exception())
 
     # ----------------------------------------------------------------------------------------
     # Handle Change Flow Request
     # ----------------------------------------------------------------------------------------
     def handleStartFlow(self):
-        self.pump.startFlow(float(self.speed_control_entry_box.displayText()),
-                            direction = self.direction_control.currentText())
-        time.sleep(0.1)
-        self.pollPumpStatus()
+        self.pump_worker.startFlow(float(self.speed_control_entry_box.displayText()),
+                                   direction = str(self.direction_control.currentText()))
+        self.pump_worker.submit(time.sleep, 0.1) # let the pump settle before reading its status
+        self.requestPumpStatus()
         
     # ----------------------------------------------------------------------------------------
     # Handle Change Flow Request
     # ----------------------------------------------------------------------------------------
     def handleStopFlow(self):
-        self.pump.stopFlow()
-        time.sleep(0.1)
-        self.pollPumpStatus()
+        self.pump_worker.stopFlow()
+        self.pump_worker.submit(time.sleep, 0.1) # let the pump settle before reading its status
+        self.requestPumpStatus()
 
     # ------------------------------------------------------------------------------------
     # Change pump based on sent command: [direction, speed]
@@ -193,9 +221,9 @@ class PumpControl(QtGui.QWidget):
         speed = command[1]
         direction = command[0]
         if speed < 0.01:
-            self.pump.stopFlow()
+            self.pump_worker.stopFlow()
         else:
-            self.pump.startFlow(speed, direction)
+            self.pump_worker.startFlow(speed, direction)
 
     # ------------------------------------------------------------------------------------
     # Determine Enabled State
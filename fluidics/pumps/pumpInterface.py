@@ -0,0 +1,246 @@
+#!/usr/bin/python
+# ----------------------------------------------------------------------------------------
+# The interface shared by all pump drivers (rainin_rp1, gilson_mp3, pololu_tic) and a
+# worker that owns a pump. All I/O with a pump happens on its worker thread, one
+# request at a time, so the GUI thread never waits on a serial or USB transaction:
+# requests return a PumpFuture that is completed by the worker.
+# ----------------------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------------------
+# Import
+# ----------------------------------------------------------------------------------------
+import collections
+import Queue
+import threading
+
+# ----------------------------------------------------------------------------------------
+# Pump status record: the same 6 fields (and order) every driver has always returned
+# ----------------------------------------------------------------------------------------
+PumpStatus = collections.namedtuple("PumpStatus", ["flow_status",    # "Flowing", "Stopped" or "Unknown"
+                                                   "speed",          # rpm
+                                                   "direction",      # "Forward" or "Reverse"
+                                                   "control_status", # "Remote", "Keypad", ...
+                                                   "auto_start",     # "Enabled" or "Disabled"
+                                                   "error_status"])
+
+# ----------------------------------------------------------------------------------------
+# AbstractPump Class Definition
+# ----------------------------------------------------------------------------------------
+class AbstractPump(object):
+
+    # Capabilities: override in the drivers
+    reversible = False # the flow direction can be changed
+    volumetric = False # speeds are flow rates rather than rotation rates
+    encoder = False    # the reported speed is measured rather than commanded
+
+    identification = ""
+
+    # ------------------------------------------------------------------------------------
+    # Close the connection to the pump
+    # ------------------------------------------------------------------------------------
+    def close(self):
+        raise NotImplementedError
+
+    # ------------------------------------------------------------------------------------
+    # Return the capability flags of the pump
+    # ------------------------------------------------------------------------------------
+    def getCapabilities(self):
+        return {"reversible": self.reversible,
+                "volumetric": self.volumetric,
+                "encoder": self.encoder}
+
+    # ------------------------------------------------------------------------------------
+    # Return the status of the pump as a PumpStatus
+    # ------------------------------------------------------------------------------------
+    def getStatus(self):
+        raise NotImplementedError
+
+    # ------------------------------------------------------------------------------------
+    # Set Flow Direction: True = Forward; False = Reverse
+    # ------------------------------------------------------------------------------------
+    def setFlowDirection(self, forward):
+        raise NotImplementedError
+
+    # ------------------------------------------------------------------------------------
+    # Set Speed
+    # ------------------------------------------------------------------------------------
+    def setSpeed(self, rotation_speed):
+        raise NotImplementedError
+
+    # ------------------------------------------------------------------------------------
+    # Start Flow
+    # ------------------------------------------------------------------------------------
+    def startFlow(self, speed, direction = "Forward"):
+        raise NotImplementedError
+
+    # ------------------------------------------------------------------------------------
+    # Stop Flow
+    # ------------------------------------------------------------------------------------
+    def stopFlow(self):
+        raise NotImplementedError
+
+# ----------------------------------------------------------------------------------------
+# PumpFuture Class Definition: the pending result of a request to a pump worker
+# ----------------------------------------------------------------------------------------
+class PumpFuture(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.callbacks = []
+        self.value = None
+        self.error = None
+
+    # ------------------------------------------------------------------------------------
+    # Call function(future) once the request completes (immediately if it already has).
+    # Callbacks run on the worker thread: emit a Qt signal to get back to the GUI thread
+    # ------------------------------------------------------------------------------------
+    def addDoneCallback(self, function):
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(function)
+                return
+        function(self)
+
+    # ------------------------------------------------------------------------------------
+    # Check if the request has completed
+    # ------------------------------------------------------------------------------------
+    def done(self):
+        return self.event.is_set()
+
+    # ------------------------------------------------------------------------------------
+    # Return the exception raised by the request (None if it succeeded)
+    # ------------------------------------------------------------------------------------
+    def exception(self, timeout = None):
+        if not self.event.wait(timeout):
+            raise RuntimeError("Pump request still pending after " + str(timeout) + " s")
+        return self.error
+
+    # ------------------------------------------------------------------------------------
+    # Wait for the request and return its result (re-raising its exception)
+    # ------------------------------------------------------------------------------------
+    def result(self, timeout = None):
+        if self.exception(timeout) is not None:
+            raise self.error
+        return self.value
+
+    # ------------------------------------------------------------------------------------
+    # Complete the request (called by the worker)
+    # ------------------------------------------------------------------------------------
+    def setResult(self, value = None, error = None):
+        with self.lock:
+            self.value = value
+            self.error = error
+            self.event.set()
+            callbacks = self.callbacks
+            self.callbacks = []
+        for function in callbacks:
+            try:
+                function(self)
+            except Exception as callback_error:
+                print "Pump callback failed: " + str(callback_error)
+
+# ----------------------------------------------------------------------------------------
+# PumpWorker Class Definition: serialises all I/O with one pump on its own thread
+# ----------------------------------------------------------------------------------------
+class PumpWorker(threading.Thread):
+    def __init__(self,
+                 pump = None,
+                 verbose = False):
+
+        # Initialize parent class
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        # Define local attributes
+        self.pump = pump
+        self.verbose = verbose
+        self.requests = Queue.Queue()
+
+        self.start()
+
+    # ------------------------------------------------------------------------------------
+    # Stop the worker after the pending requests, closing the pump on its thread
+    # ------------------------------------------------------------------------------------
+    def close(self, timeout = 5.0):
+        future = self.submit(self.pump.close)
+        self.requests.put(None)
+        self.join(timeout)
+        return future
+
+    # ------------------------------------------------------------------------------------
+    # Return the capability flags of the pump (no I/O)
+    # ------------------------------------------------------------------------------------
+    def getCapabilities(self):
+        return self.pump.getCapabilities()
+
+    # ------------------------------------------------------------------------------------
+    # Request the pump status: the future returns a PumpStatus
+    # ------------------------------------------------------------------------------------
+    def getStatus(self):
+        return self.submit(self.pump.getStatus)
+
+    # ------------------------------------------------------------------------------------
+    # Process requests in the order they were submitted
+    # ------------------------------------------------------------------------------------
+    def run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            [future, function, args, kwargs] = request
+            try:
+                future.setResult(value = function(*args, **kwargs))
+            except Exception as error:
+                if self.verbose:
+                    print "Pump request " + function.__name__ + " failed: " + str(error)
+                future.setResult(error = error)
+
+    # ------------------------------------------------------------------------------------
+    # Request a speed change
+    # ------------------------------------------------------------------------------------
+    def setSpeed(self, rotation_speed):
+        return self.submit(self.pump.setSpeed, rotation_speed)
+
+    # ------------------------------------------------------------------------------------
+    # Request flow at a speed and direction
+    # ------------------------------------------------------------------------------------
+    def startFlow(self, speed, direction = "Forward"):
+        return self.submit(self.pump.startFlow, speed, direction = direction)
+
+    # ------------------------------------------------------------------------------------
+    # Request a stop
+    # ------------------------------------------------------------------------------------
+    def stopFlow(self):
+        return self.submit(self.pump.stopFlow)
+
+    # ------------------------------------------------------------------------------------
+    # Queue function(*args, **kwargs) for the worker thread and return its PumpFuture
+    # ------------------------------------------------------------------------------------
+    def submit(self, function, *args, **kwargs):
+        future = PumpFuture()
+        self.requests.put([future, function, args, kwargs])
+        return future
+
+#
+# The MIT License
+#
+# Copyright (c) 2013 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
@@ -13,11 +13,16 @@
 import serial
 import sys
 import time
+from pumpInterface import AbstractPump, PumpStatus
 
 # ----------------------------------------------------------------------------------------
 # RaininRP1 Class Definition
 # ----------------------------------------------------------------------------------------
-class APump():
+class APump(AbstractPump):
+
+    # Capabilities
+    reversible = True
+
     def __init__(self,
                  parameters = False):
 
@@ -27,6 +32,7 @@ class APump():
         self.verbose = parameters.get("verbose", True)
         self.simulate = parameters.get("simulate_pump", True)
         self.serial_verbose = parameters.get("serial_verbose", False)
+        self.max_attempt_number = parameters.get("pump_max_attempts", 10) # ready polls and writes per buffered command
         
         # Create serial port
         if not self.simulate:
@@ -46,7 +52,8 @@ class APump():
         self.pound_sign = '\x23'
         self.disconnect_signal = '\xFF'
         self.message_complete_flag = 128
-        self.max_attempt_number = 10
+        self.drain_time = 0.05          # longest wait for late bytes before a buffered command (s)
+        self.drain_quiet_time = 0.005   # silence that ends the drain early (s)
 
         # Define initial pump status
         self.flow_status = "Stopped"
@@ -111,9 +118,9 @@ class APump():
     def enableRemoteControl(self, remote_control):
         if not self.simulate:
             if remote_control:
-                self.sendBufferedCommand("L")
+                if self.sendBufferedCommand("L"): self.control_status = "Remote"
             else:
-                self.sendBufferedCommand("U")
+                if self.sendBufferedCommand("U"): self.control_status = "Keypad"
         else:
             if remote_control: self.control_status == "Remote"
             else: self.control_status == "Keypad"
@@ -146,8 +153,8 @@ class APump():
         # Update the status from a status inquiry
         self.requestStatus()
 
-        return (self.flow_status, self.speed, self.direction,
-                self.control_status, self.auto_start, self.error_status)
+        return PumpStatus(self.flow_status, self.speed, self.direction,
+                          self.control_status, self.auto_start, self.error_status)
 
     # ------------------------------------------------------------------------------------
     # Get Rainin Status from Current Display
@@ -215,43 +222,42 @@ class APump():
         return base_string
 
     # ------------------------------------------------------------------------------------
-    # Send Buffered Command
+    # Send Buffered Command: the whole frame is written at once and its echo verified as
+    # a block. Ready polls and writes share one budget of max_attempt_number attempts,
+    # so a pump that does not answer blocks for at most that many read timeouts. The
+    # pump status is only refreshed if requested. Returns True if the pump echoed the
+    # command correctly.
     # ------------------------------------------------------------------------------------ 
-    def sendBufferedCommand(self, command_string):
+    def sendBufferedCommand(self, command_string, refresh_status = False):
         # Compose command message
-        command_message = command_string + self.carriage_return;
+        command_message = command_string + self.carriage_return
 
-        # Poll pump to determine if ready for buffered command
+        sent = False
         ready = False
-        attempt_number = 0
-        while not ready:
-            self.write(self.line_feed)
-            response = self.read(1)
-            if response == self.ready_signal:
-                ready = True
-                self.read(10) # Clear buffer
-                if self.serial_verbose: print "Received Ready Signal"
-            else:
-                attempt_number += 1
-                if self.serial_verbose: print "Received Busy Signal"
-            if attempt_number > self.max_attempt_number:
-                ready = True
-                print "Error in sending buffered command: Pump not ready"
-        
-        # Write buffered command
-        attempt_number = 0
-        for character in command_message:
-            received = False
-            while not received:
-                self.write(chr(ord(character)))
-                response = self.read(1)
-                if response == character:
-                    received = True
-                else:
-                    if self.verbose: print "Error in transmission of " + str((character, ''))
+        for attempt_number in range(self.max_attempt_number):
+            # Poll pump to determine if ready for buffered command
+            if not ready:
+                ready = self.isReady()
+                continue
+
+            # Write buffered command and check the echo
+            self.write(command_message)
+            echo = self.read(len(command_message))
+            if echo == command_message:
+                sent = True
+                break
+            if self.verbose: print "Error in transmission of " + str((command_message, echo))
+            self.drainInput() # Discard the rest of a garbled echo
+            ready = False
+
+        if not sent:
+            if not ready: print "Error in sending buffered command: Pump not ready"
+            print "Error in sending buffered command: " + str((command_string, ''))
 
         # Update the pump status after a buffered command
-        self.getStatus()
+        if refresh_status:
+            self.getStatus()
+        return sent
         
     # ------------------------------------------------------------------------------------
     # Send Immediate Command
@@ -284,7 +290,8 @@ class APump():
             if forward: direction_message = "jF"
             else: direction_message = "jB"
 
-            self.sendBufferedCommand(direction_message)
+            if not self.sendBufferedCommand(direction_message):
+                return False
 
             # Check status to see if the desired change was made
             ## NEED CODE HERE
@@ -305,7 +312,8 @@ class APump():
                 # Convert rotation speed to the rotation integer that will be sent
                 rotation_int = int(rotation_speed*100)
                 rotation_message = "R" + ("%04d" % rotation_int)
-                self.sendBufferedCommand(rotation_message)
+                if not self.sendBufferedCommand(rotation_message):
+                    return False
 
                 # Check status to see if the desired change was made
                 ## NEED CODE HERE
@@ -315,6 +323,7 @@ class APump():
                 return False
 
         if rotation_speed >= 0 and rotation_speed <= 48:
+            self.speed = rotation_speed
             if self.verbose:
                 print "   " + "Set Speed: " + str(self.speed)
         return True
@@ -352,6 +361,35 @@ class APump():
             self.flow_status = "Stopped"
         return True
 
+    # ------------------------------------------------------------------------------------
+    # Discard late bytes: read until the line has been quiet for drain_quiet_time (at
+    # most drain_time), then flush whatever is left
+    # ------------------------------------------------------------------------------------ 
+    def drainInput(self):
+        end_time = time.time() + self.drain_time
+        quiet_end_time = time.time() + self.drain_quiet_time
+        while time.time() < min(end_time, quiet_end_time):
+            waiting = self.serial.inWaiting()
+            if waiting > 0:
+                self.read(waiting)
+                quiet_end_time = time.time() + self.drain_quiet_time
+            else:
+                time.sleep(0.001)
+        self.serial.flushInput()
+
+    # ------------------------------------------------------------------------------------
+    # Poll pump once to determine if it is ready for a buffered command
+    # ------------------------------------------------------------------------------------ 
+    def isReady(self):
+        self.write(self.line_feed)
+        response = self.read(1)
+        if response == self.ready_signal:
+            self.drainInput() # Clear the rest of the ready response before the command
+            if self.serial_verbose: print "Received Ready Signal"
+            return True
+        if self.serial_verbose: print "Received Busy Signal"
+        return False
+
     # ------------------------------------------------------------------------------------
     # Write to Serial Port
     # ------------------------------------------------------------------------------------ 
@@ -259,6 +259,77 @@ TIC_VAR_INPUT_AFTER_SCALING = 0x51
 
 TIC_VARIABLES_SIZE = 0x55
 
+# Layout of the variable block: (name, offset, little endian struct format)
+TIC_VARIABLE_LAYOUT = [
+    ("operation_state", TIC_VAR_OPERATION_STATE, "B"),
+    ("energized_position_uncertain", TIC_VAR_MISC_FLAGS1, "B"),
+    ("error_status", TIC_VAR_ERROR_STATUS, "H"),
+    ("errors_occurred", TIC_VAR_ERRORS_OCCURRED, "I"),
+    ("planning_mode", TIC_VAR_PLANNING_MODE, "B"),
+    ("target_position", TIC_VAR_TARGET_POSITION, "i"),
+    ("target_velocity", TIC_VAR_TARGET_VELOCITY, "i"),
+    ("starting_speed", TIC_VAR_STARTING_SPEED, "I"),
+    ("max_speed", TIC_VAR_MAX_SPEED, "I"),
+    ("max_decel", TIC_VAR_MAX_DECEL, "I"),
+    ("max_accel", TIC_VAR_MAX_ACCEL, "I"),
+    ("current_position", TIC_VAR_CURRENT_POSITION, "i"),
+    ("current_velocity", TIC_VAR_CURRENT_VELOCITY, "i"),
+    ("acting_target_position", TIC_VAR_ACTING_TARGET_POSITION, "i"),
+    ("time_since_last_step", TIC_VAR_TIME_SINCE_LAST_STEP, "I"),
+    ("device_reset", TIC_VAR_DEVICE_RESET, "B"),
+    ("vin_voltage", TIC_VAR_VIN_VOLTAGE, "H"),
+    ("up_time", TIC_VAR_UP_TIME, "I"),
+    ("encoder_position", TIC_VAR_ENCODER_POSITION, "i"),
+    ("rc_pulse_width", TIC_VAR_RC_PULSE_WIDTH, "H"),
+    ("analog_reading_scl", TIC_VAR_ANALOG_READING_SCL, "H"),
+    ("analog_reading_sda", TIC_VAR_ANALOG_READING_SDA, "H"),
+    ("analog_reading_tx", TIC_VAR_ANALOG_READING_TX, "H"),
+    ("analog_reading_rx", TIC_VAR_ANALOG_READING_RX, "H"),
+    ("digital_readings", TIC_VAR_DIGITAL_READINGS, "B"),
+    ("pin_states", TIC_VAR_PIN_STATES, "B"),
+    ("step_mode", TIC_VAR_STEP_MODE, "B"),
+    ("current_limit", TIC_VAR_CURRENT_LIMIT, "B"),
+    ("decay_mode", TIC_VAR_DECAY_MODE, "B"),
+    ("input_state", TIC_VAR_INPUT_STATE, "B"),
+    ("input_after_averaging", TIC_VAR_INPUT_AFTER_AVERAGING, "H"),
+    ("input_after_hysteresis", TIC_VAR_INPUT_AFTER_HYSTERESIS, "H"),
+    ("input_after_scaling", TIC_VAR_INPUT_AFTER_SCALING, "h"),
+    ]
+
+def variable_block_struct(layout, size):
+    # one struct for the whole block, with padding over the bytes no field uses
+    fmt = "<"
+    position = 0
+    for name, offset, field_fmt in sorted(layout, key=lambda field: field[1]):
+        if offset > position:
+            fmt += "%dx" % (offset - position)
+        fmt += field_fmt
+        position = offset + struct.calcsize("<" + field_fmt)
+    if size > position:
+        fmt += "%dx" % (size - position)
+    return struct.Struct(fmt)
+
+TIC_VARIABLE_NAMES = [field[0] for field in sorted(TIC_VARIABLE_LAYOUT, key=lambda field: field[1])]
+TIC_VARIABLE_STRUCT = variable_block_struct(TIC_VARIABLE_LAYOUT, TIC_VARIABLES_SIZE)
+TIC_VARIABLE_FIELDS = dict((name, (offset, struct.Struct("<" + fmt))) for name, offset, fmt in TIC_VARIABLE_LAYOUT)
+TIC_STATUS_VARIABLES = ("operation_state", "energized_position_uncertain", "error_status")
+TIC_MOVE_VARIABLES = ("operation_state", "error_status", "target_position", "current_position",
+                      "current_velocity", "input_state")
+# named fields further apart than this (bytes) are fetched with separate reads
+TIC_MAX_READ_GAP = 32
+
+def variable_spans(names):
+    # group the named fields into (offset, length, names) spans, one read per span
+    fields = sorted([(TIC_VARIABLE_FIELDS[name][0], TIC_VARIABLE_FIELDS[name][1].size, name) for name in names])
+    spans = []
+    for field_offset, size, name in fields:
+        if spans and field_offset - (spans[-1][0] + spans[-1][1]) <= TIC_MAX_READ_GAP:
+            span_offset, length, span_names = spans[-1]
+            spans[-1] = (span_offset, max(length, field_offset + size - span_offset), span_names + [name])
+        else:
+            spans.append((field_offset, size, [name]))
+    return spans
+
 # indexes
 TIC_SETTING_NOT_INITIALIZED = 0x00
 TIC_SETTING_CONTROL_MODE = 0x01
@@ -406,6 +477,24 @@ class TicError(Exception):
     pass
 
 
+class TicVariables(object):
+    # Decoded tic variables: a slotted record that can also be used as variables['name']
+    __slots__ = TIC_VARIABLE_NAMES
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def __setitem__(self, name, value):
+        setattr(self, name, value)
+
+    def keys(self):
+        return list(self.__slots__)
+
+
 class TicDevice:
     # Encapsulates the logic to control a tic stepper driver
     def __init__(self):
@@ -419,7 +508,7 @@ class TicDevice:
         self.cfg = None
         self.intf = None
         self.poll_period = .01
-        self.variables={}
+        self.variables = TicVariables()
         self.init_defaults()
 
     def close(self):
@@ -588,20 +677,20 @@ class TicDevice:
         return buffer
 
     def wait_for_device_ready(self):
-        self.get_variables()
+        self.get_variables(names = TIC_STATUS_VARIABLES)
         while self.variables ['operation_state'] != 10:
-            self.get_variables()
+            self.get_variables(names = TIC_STATUS_VARIABLES)
             es = self.get_error_status(self.variables['error_status'])
             log.debug ("op state:" + str(self.variables ['operation_state']) + " err:" + \
                        str(self.variables ['error_status']) + " " + es )
             time.sleep(self.poll_period)
-            ticdev.reset_command_timeout()
+            self.reset_command_timeout()
         log.debug (str(self.variables ['operation_state']) + " err:" + \
                        str(self.variables ['error_status'])
                       )
 
     def wait_for_move_complete(self):
-        self.get_variables()
+        self.get_variables(names = TIC_MOVE_VARIABLES)
         while (self.variables ['operation_state'] == 10 and \
             self.variables ['current_position'] != self.variables ['target_position'] ):
             if self.variables ['input_state'] == 2:
@@ -609,7 +698,7 @@ class TicDevice:
             if self.variables ['input_state'] == 1:
                 break
 
-            self.get_variables(  )
+            self.get_variables(names = TIC_MOVE_VARIABLES)
             log.debug ("operation state:" + \
                        str(self.variables ['operation_state']) + " input state:" + \
                        str(self.variables ['input_state']) + " err:" + \
@@ -623,17 +712,7 @@ class TicDevice:
             #ticdev.reset_command_timeout()
 
     def get_status_variables (self, clear_errors = False):
-        assert(TIC_VARIABLES_SIZE <= TIC_MAX_USB_RESPONSE_SIZE)
-        if clear_errors:
-            cmd = TIC_CMD_GET_VARIABLE_AND_CLEAR_ERRORS_OCCURRE
-        else:
-            cmd = TIC_CMD_GET_VARIABLE
-        log.debug (hex(TIC_REQUEST_VARIABLES))
-        buffer = self.transfer(request_type= TIC_REQUEST_VARIABLES,
-                               request= cmd,
-                               data_or_length =  TIC_VARIABLES_SIZE,
-                               msg="getting variables.")
-        self.parse_status_variables (buffer)
+        return self.get_variables(clear_errors, names = TIC_STATUS_VARIABLES)
 
     def get_error_status(self, val):
         s = ""
@@ -644,45 +723,41 @@ class TicDevice:
 
 
     def parse_status_variables (self, buffer):
-        self.variables['operation_state'] = byte2int (buffer [TIC_VAR_OPERATION_STATE:TIC_VAR_OPERATION_STATE+1],byteorder='little')
-        self.variables['energized_position_uncertain'] = byte2int(buffer [0x1:0x2],byteorder='little')
-        self.variables['error_status'] = byte2int (buffer [0x2:0x4],byteorder='little')
+        self.decode_variables(buffer, names = TIC_STATUS_VARIABLES)
+
+    def decode_variables(self, buffer, offset = 0, names = None):
+        # buffer holds the variable block from offset on: decode all of it in one unpack,
+        # or only the named fields
+        if names is None and offset == 0:
+            for name, value in zip(TIC_VARIABLE_NAMES, TIC_VARIABLE_STRUCT.unpack_from(buffer)):
+                self.variables[name] = value
+        else:
+            for name in (TIC_VARIABLE_NAMES if names is None else names):
+                field_offset, field_struct = TIC_VARIABLE_FIELDS[name]
+                self.variables[name] = field_struct.unpack_from(buffer, field_offset - offset)[0]
+        if names is None or "vin_voltage" in names:
+            self.variables['vin_voltage'] = self.variables['vin_voltage'] / 1000
+        return self.variables
 
-    def get_variables(self, clear_errors = False):
+    def get_variables(self, clear_errors = False, names = None):
+        # read the whole variable block, or only the spans that hold the named fields
         assert(TIC_VARIABLES_SIZE <= TIC_MAX_USB_RESPONSE_SIZE)
         if clear_errors:
-            cmd = TIC_CMD_GET_VARIABLE_AND_CLEAR_ERRORS_OCCURRE
+            cmd = TIC_CMD_GET_VARIABLE_AND_CLEAR_ERRORS_OCCURRED
         else:
             cmd = TIC_CMD_GET_VARIABLE
-        buffer = self.transfer(request_type= TIC_REQUEST_VARIABLES,
-                               request= cmd,
-                               data_or_length =  TIC_VARIABLES_SIZE,
-                               msg="getting variables.")
-
-        self.parse_status_variables (buffer)
-        self.variables['planning_mode'] = byte2int (buffer [TIC_VAR_PLANNING_MODE:TIC_VAR_PLANNING_MODE+1],byteorder='little')
-        self.variables['target_position'] = byte2int ( buffer [TIC_VAR_TARGET_POSITION:TIC_VAR_TARGET_POSITION+4],byteorder='little', signed=True)
-        self.variables['target_velocity'] = byte2int ( buffer [TIC_VAR_TARGET_VELOCITY:TIC_VAR_TARGET_VELOCITY+4],byteorder='little', signed=True)
-        self.variables['starting_speed'] = byte2int ( buffer [TIC_VAR_STARTING_SPEED:TIC_VAR_STARTING_SPEED+4],byteorder='little')
-        self.variables['max_speed'] = byte2int ( buffer [TIC_VAR_MAX_SPEED:TIC_VAR_MAX_SPEED+4],byteorder='little')
-        self.variables['max_decel'] = byte2int ( buffer [TIC_VAR_MAX_DECEL:TIC_VAR_MAX_DECEL+4],byteorder='little')
-        self.variables['max_accel'] = byte2int ( buffer [TIC_VAR_MAX_ACCEL:TIC_VAR_MAX_ACCEL+4],byteorder='little')
-        self.variables['current_position'] = byte2int ( buffer [TIC_VAR_CURRENT_POSITION:TIC_VAR_CURRENT_POSITION +4],byteorder='little', signed=True)
-        self.variables['current_velocity'] = byte2int ( buffer [TIC_VAR_CURRENT_VELOCITY:TIC_VAR_CURRENT_VELOCITY+4],byteorder='little', signed=True)
-        self.variables['acting_target_position'] = byte2int ( buffer [TIC_VAR_ACTING_TARGET_POSITION:TIC_VAR_ACTING_TARGET_POSITION +4],byteorder='little', signed=True)
-        self.variables['time_since_last_step'] = byte2int ( buffer [TIC_VAR_TIME_SINCE_LAST_STEP :TIC_VAR_TIME_SINCE_LAST_STEP +4],byteorder='little')
-        self.variables['device_reset'] = byte2int (buffer [TIC_VAR_DEVICE_RESET:TIC_VAR_DEVICE_RESET+1],byteorder='little')
-        self.variables['vin_voltage'] = byte2int (buffer [TIC_VAR_VIN_VOLTAGE:TIC_VAR_VIN_VOLTAGE +2],byteorder='little') / 1000
-        self.variables['up_time'] = byte2int ( buffer [TIC_VAR_UP_TIME:TIC_VAR_UP_TIME+4],byteorder='little')
-        self.variables['encoder_position'] = byte2int ( buffer [TIC_VAR_ENCODER_POSITION:TIC_VAR_ENCODER_POSITION+4], byteorder='little', signed=True)
-        self.variables['rc_pulse_width'] = byte2int (buffer [TIC_VAR_RC_PULSE_WIDTH:TIC_VAR_RC_PULSE_WIDTH+2],byteorder='little')
-        self.variables['step_mode'] = byte2int ( buffer [TIC_VAR_STEP_MODE:TIC_VAR_STEP_MODE +1], byteorder="little")
-        self.variables['current_limit'] = byte2int (buffer [TIC_VAR_CURRENT_LIMIT:TIC_VAR_CURRENT_LIMIT+1],byteorder='little')
-        self.variables['decay_mode'] = byte2int ( buffer [TIC_VAR_DECAY_MODE:TIC_VAR_DECAY_MODE+1],byteorder='little')
-        self.variables['input_state'] = byte2int ( buffer [TIC_VAR_INPUT_STATE:TIC_VAR_INPUT_STATE+1],byteorder='little')
-        self.variables['input_after_averaging'] = byte2int (buffer [TIC_VAR_INPUT_AFTER_AVERAGING:TIC_VAR_INPUT_AFTER_AVERAGING+2],byteorder='little')
-        self.variables['input_after_hysteresis'] = byte2int (buffer [TIC_VAR_INPUT_AFTER_HYSTERESIS:TIC_VAR_INPUT_AFTER_HYSTERESIS+2],byteorder='little')
-        self.variables['input_after_scaling'] = byte2int ( buffer [TIC_VAR_INPUT_AFTER_SCALING:TIC_VAR_INPUT_AFTER_SCALING+2],byteorder='little', signed=True)
+        if names is None:
+            spans = [(0, TIC_VARIABLES_SIZE, None)]
+        else:
+            spans = variable_spans(names)
+        for offset, length, span_names in spans:
+            buffer = self.transfer(request_type= TIC_REQUEST_VARIABLES,
+                                   request= cmd,
+                                   index = offset,
+                                   data_or_length = length,
+                                   msg="getting variables.")
+            self.decode_variables(buffer, offset, span_names)
+            cmd = TIC_CMD_GET_VARIABLE # errors occurred are cleared by the first read only
 
         return self.variables
 
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# ----------------------------------------------------------------------------------------
+# A worker class that owns all traffic to the USB CNC. It runs in its own QThread so
+# that a move (which polls the controller until it reports not busy) never blocks
+# the Qt event loop, and it reports each completed move through a Qt signal.
+# ----------------------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------------------
+# Import
+# ----------------------------------------------------------------------------------------
+from PyQt4 import QtCore
+from cnc_talk import CNCTimeout
+
+# ----------------------------------------------------------------------------------------
+# CNCWorker Class Definition
+# ----------------------------------------------------------------------------------------
+class CNCWorker(QtCore.QObject):
+
+    # Define custom signals
+    move_done_signal = QtCore.pyqtSignal(object) # dictionary describing the finished move
+
+    # Define request signals: emitted from the GUI thread, handled in the worker thread
+    move_signal = QtCore.pyqtSignal(object, int) # port (or (plate, port)), direction
+
+    def __init__(self,
+                 cnc = None,
+                 verbose = False):
+
+        # Initialize parent class
+        QtCore.QObject.__init__(self)
+
+        # Define local attributes
+        self.cnc = cnc
+        self.verbose = verbose
+        self.position = tuple(self.cnc.coords()) # last known position, read before the thread starts
+
+        # Connect request signals: queued once the worker has been moved to its thread
+        self.move_signal.connect(self.move)
+
+    # ------------------------------------------------------------------------------------
+    # Return the position at the end of the last move: safe to call from any thread
+    # ------------------------------------------------------------------------------------
+    def getPosition(self):
+        return self.position
+
+    # ------------------------------------------------------------------------------------
+    # Move to a port (executed in the worker thread)
+    # ------------------------------------------------------------------------------------
+    @QtCore.pyqtSlot(object, int)
+    def move(self, port, direction):
+        start_position = self.position
+        start_time = self.cnc.clock.time() # simulated CNCs run on a virtual clock
+        completed = True
+        try:
+            self.cnc.move(port, direction)
+        except CNCTimeout as error:
+            print "CNC move to " + str(port) + " failed: " + str(error)
+            completed = False
+        except Exception as error: # e.g. a USB error or an unknown port: the move must still be reported
+            print "CNC move to " + str(port) + " failed (" + type(error).__name__ + "): " + str(error)
+            completed = False
+        try:
+            self.position = tuple(self.cnc.coords())
+        except Exception as error:
+            print "CNC position could not be read: " + str(error)
+        self.move_done_signal.emit({"port": port,
+                                    "direction": direction,
+                                    "start_position": start_position,
+                                    "time": self.cnc.clock.time() - start_time,
+                                    "completed": completed})
+
+#
+# The MIT License
+#
+# Copyright (c) 2013 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
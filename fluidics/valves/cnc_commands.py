@@ -1,113 +1,178 @@
-import crccheck
-import struct
-
-def cmd_int(value):
-    return map(ord, struct.pack("i", int(value)))
-
-def cmd_checksum(cmd):
-    return crccheck.crc.Crc8DvbS2.calc(cmd)
-
-def cmd_append_checksum(cmd):
-    if len(cmd) < 63:
-        cmd += [0] * (63 - len(cmd))
-    return cmd_to_binary(cmd + [cmd_checksum(cmd)])
-
-def cmd_speed(speed):
-    rate = (460780 * 2000/speed)
-    integral = cmd_int(rate)
-    beginning_part = [0xBF, 0, 0, 0, 0x80, 0]
-    return cmd_append_checksum(beginning_part + integral * 3)
-
-def cmd_init_1(speed = 200):
-    integral = cmd_int(speed)
-    beginning_part = [0x9F, 0, 0, 0, 0x80, 0xB0]
-    return cmd_append_checksum(beginning_part + integral * 4)
-
-def cmd_init_2():
-    beginning_part = [0xA0, 0, 0, 0, 0x80, 0x92]
-    cmd_channel = [0x9f, 0x8C, 0x00, 0x00] * 4
-    cmd_gap = [0x00] * 20
-    cmd_something = [0x60, 0x09, 0x00, 0x00]
-    cmd_rest = [0x00] * 10 + [0x00, 0xff, 0x01, 0x00]
-    return cmd_append_checksum(beginning_part + cmd_channel + cmd_gap + cmd_something + cmd_rest)
-
-def cmd_init_3():
-    integral = cmd_int(18)
-    beginning_part = [0xA1, 0, 0, 0, 0x80, 0x00]
-    return cmd_append_checksum(beginning_part + integral * 4)
-
-def cmd_init_4():
-    integral = [0x00, 0x10, 0x0E, 0x00] #cmd_int(33)
-    beginning_part = [0xBF, 0, 0, 0, 0x80, 0x00]
-    return cmd_append_checksum(beginning_part + integral * 4)
-
-def cmd_init_5():
-    beginning_part = [0xB5, 0, 0, 0, 0x80, 0x01, 0x01, 0x00, 0x00, 0x00, 0xff, 0xff, 0x04]
-    return cmd_append_checksum(beginning_part)
-
-def cmd_init_6():
-    beginning_part = [0xB6, 0, 0, 0, 0x80, 0x01, 0x02, 0x01, 0x03]
-    return cmd_append_checksum(beginning_part)
-
-def cmd_init_7():
-    beginning_part = [0xC2, 0, 0, 0, 0x80, 0x01]
-    return cmd_append_checksum(beginning_part)
-
-def cmd_init_8():
-    beginning_part = [0x9D, 0, 0, 0, 0x80, 0x01]
-    return cmd_append_checksum(beginning_part)
-
-def cmd_init_9():
-    beginning_part = [0x9E, 0, 0, 0, 0x80, 0x00]
-    return cmd_append_checksum(beginning_part)
-
-def cmd_init_10():
-    beginning_part = [0x9E, 0, 0, 0, 0x80, 0x00]
-    return cmd_append_checksum(beginning_part)
-
-def cmd_zero(speed):
-    rate = (460780 * 2000/speed)
-    integral = cmd_int(rate)
-    beginning_part = [0xBF, 0, 0, 0, 0x80, 0]
-    return cmd_append_checksum(beginning_part + integral * 3)
-
-def parse_reply(msg):
-    x, y, z = struct.unpack("iii", msg[24:36])
-    return {"x": x*0.05, "y": y*0.05, "z": z*0.05, "busy": msg[1] == 0x0D, "zeroed": msg[24] == 0x13}
-
-def cmd_mill():
-    return cmd_append_checksum([0xAB, 0, 0, 0, 0x80, 0])
-
-def cmd_stop():
-    return cmd_append_checksum([0xAA, 0, 0, 0, 0x80, 0])
-
-def cmd_zero():
-    return cmd_append_checksum([0xCA, 0, 0, 0, 0, 0x39])
-
-def cmd_zero_xy():
-    return cmd_append_checksum([0xCA, 0, 0, 0, 0, 0x39] + [0] * 37 + [0x23, 0x07])
-
-def cmd_pos_slow(x=0, y=0, z=0):
-    return cmd_append_checksum([0xCA, 0, 0, 0, 0, 0x39] + cmd_int(x/0.05) + cmd_int(y/0.05) + cmd_int(z/0.05) + [0] * 26 + [0x08, 0x07])
-
-def cmd_pos_fast(x=0, y=0, z=0):
-    return cmd_append_checksum([0xCA, 0, 0, 0, 0, 0x39] + cmd_int(x/0.05) + cmd_int(y/0.05) + cmd_int(z/0.05) + [0] * 26 + [0xA4, 0x07])
-#     that second-to-last byte seems uninterpreted so far.
-
-def cmd_move(dir="none", step=False):
-    dirs = {"right": 0x01, "left": 0x02, "back": 0x04, "forward": 0x08, "up": 0x10, "down": 0x20, "none": 0, "stop": 0}
-    return cmd_append_checksum([0xBE, 0, 0, 0, 0x80, 1 if step else 0] + [dirs[dir]] + [0, 0, 0, 0x10, 0x0E] + [0] * 10 + [0x14 if step else 0])
-
-def cmd_set_offset(x=0, y=0, z=0):
-    return cmd_append_checksum([0xC8, 0, 0, 0, 0, 0] + cmd_int(x/0.05) + cmd_int(y/0.05) + cmd_int(z/0.05))
-
-def cmd_to_binary(cmd):
-    assert len(cmd) == 64
-    assert max(cmd) < 256
-    return struct.pack("B" * 64, *[c for c in cmd])
-
-def cmd_spindle_on():
-    return cmd_append_checksum([0xB5, 0, 0, 0, 0x80, 0x02, 0x01, 0, 0, 0, 0x5F, 0xF0])
-
-def cmd_spindle_off():
-    return cmd_append_checksum([0xB5, 0, 0, 0, 0x80, 0x01, 0x01, 0, 0, 0, 0x5F, 0xF0])
+import inspect
+import struct
+
+# Every frame is 64 bytes (returned as bytes): 63 bytes of command followed by a
+# CRC-8/DVB-S2 checksum
+
+def crc_table(polynomial=0xD5):
+    table = []
+    for byte in range(256):
+        crc = byte
+        for bit in range(8):
+            crc = ((crc << 1) ^ polynomial) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return table
+
+CRC_TABLE = crc_table()
+
+def frame_cache(function):
+    """Memoise a command whose frame only depends on its arguments.
+
+    The cache is keyed on the bound arguments, so cmd_move("up"), cmd_move(dir="up")
+    and cmd_move("up", False) share one frame.
+    """
+    frames = {}
+    def cached(*args, **kwargs):
+        key = tuple(sorted(inspect.getcallargs(function, *args, **kwargs).items()))
+        if key not in frames:
+            frames[key] = function(*args, **kwargs)
+        return frames[key]
+    cached.__name__ = function.__name__
+    cached.__doc__ = function.__doc__
+    return cached
+
+def cmd_int(value):
+    return map(ord, struct.pack("i", int(value)))
+
+def cmd_checksum(cmd, length=None):
+    crc = 0
+    for i in range(len(cmd) if length is None else length):
+        crc = CRC_TABLE[crc ^ cmd[i]]
+    return crc
+
+def cmd_append_checksum(cmd):
+    frame = bytearray(64)
+    frame[:len(cmd)] = bytearray(cmd)
+    frame[63] = cmd_checksum(frame, 63)
+    return bytes(frame)
+
+def cmd_template(cmd):
+    """Return a 64 byte frame with cmd at its start, to be filled in by pack_frame."""
+    frame = bytearray(64)
+    frame[:len(cmd)] = bytearray(cmd)
+    return frame
+
+def pack_frame(template, offset, *values):
+    """Copy a template, pack int32 values into it at offset and set the checksum."""
+    frame = bytearray(template)
+    struct.pack_into("<%di" % len(values), frame, offset, *[int(v) for v in values])
+    frame[63] = cmd_checksum(frame, 63)
+    return bytes(frame)
+
+@frame_cache
+def cmd_speed(speed):
+    rate = (460780 * 2000/speed)
+    integral = cmd_int(rate)
+    beginning_part = [0xBF, 0, 0, 0, 0x80, 0]
+    return cmd_append_checksum(beginning_part + integral * 3)
+
+@frame_cache
+def cmd_init_1(speed = 200):
+    integral = cmd_int(speed)
+    beginning_part = [0x9F, 0, 0, 0, 0x80, 0xB0]
+    return cmd_append_checksum(beginning_part + integral * 4)
+
+@frame_cache
+def cmd_init_2():
+    beginning_part = [0xA0, 0, 0, 0, 0x80, 0x92]
+    cmd_channel = [0x9f, 0x8C, 0x00, 0x00] * 4
+    cmd_gap = [0x00] * 20
+    cmd_something = [0x60, 0x09, 0x00, 0x00]
+    cmd_rest = [0x00] * 10 + [0x00, 0xff, 0x01, 0x00]
+    return cmd_append_checksum(beginning_part + cmd_channel + cmd_gap + cmd_something + cmd_rest)
+
+@frame_cache
+def cmd_init_3():
+    integral = cmd_int(18)
+    beginning_part = [0xA1, 0, 0, 0, 0x80, 0x00]
+    return cmd_append_checksum(beginning_part + integral * 4)
+
+@frame_cache
+def cmd_init_4():
+    integral = [0x00, 0x10, 0x0E, 0x00] #cmd_int(33)
+    beginning_part = [0xBF, 0, 0, 0, 0x80, 0x00]
+    return cmd_append_checksum(beginning_part + integral * 4)
+
+@frame_cache
+def cmd_init_5():
+    beginning_part = [0xB5, 0, 0, 0, 0x80, 0x01, 0x01, 0x00, 0x00, 0x00, 0xff, 0xff, 0x04]
+    return cmd_append_checksum(beginning_part)
+
+@frame_cache
+def cmd_init_6():
+    beginning_part = [0xB6, 0, 0, 0, 0x80, 0x01, 0x02, 0x01, 0x03]
+    return cmd_append_checksum(beginning_part)
+
+@frame_cache
+def cmd_init_7():
+    beginning_part = [0xC2, 0, 0, 0, 0x80, 0x01]
+    return cmd_append_checksum(beginning_part)
+
+@frame_cache
+def cmd_init_8():
+    beginning_part = [0x9D, 0, 0, 0, 0x80, 0x01]
+    return cmd_append_checksum(beginning_part)
+
+@frame_cache
+def cmd_init_9():
+    beginning_part = [0x9E, 0, 0, 0, 0x80, 0x00]
+    return cmd_append_checksum(beginning_part)
+
+@frame_cache
+def cmd_init_10():
+    beginning_part = [0x9E, 0, 0, 0, 0x80, 0x00]
+    return cmd_append_checksum(beginning_part)
+
+@frame_cache
+def cmd_zero(speed):
+    rate = (460780 * 2000/speed)
+    integral = cmd_int(rate)
+    beginning_part = [0xBF, 0, 0, 0, 0x80, 0]
+    return cmd_append_checksum(beginning_part + integral * 3)
+
+def parse_reply(msg):
+    x, y, z = struct.unpack("iii", msg[24:36])
+    return {"x": x*0.05, "y": y*0.05, "z": z*0.05, "busy": msg[1] == 0x0D, "zeroed": msg[24] == 0x13}
+
+@frame_cache
+def cmd_mill():
+    return cmd_append_checksum([0xAB, 0, 0, 0, 0x80, 0])
+
+@frame_cache
+def cmd_stop():
+    return cmd_append_checksum([0xAA, 0, 0, 0, 0x80, 0])
+
+@frame_cache
+def cmd_zero():
+    return cmd_append_checksum([0xCA, 0, 0, 0, 0, 0x39])
+
+@frame_cache
+def cmd_zero_xy():
+    return cmd_append_checksum([0xCA, 0, 0, 0, 0, 0x39] + [0] * 37 + [0x23, 0x07])
+
+POS_SLOW_TEMPLATE = cmd_template([0xCA, 0, 0, 0, 0, 0x39] + [0] * 12 + [0] * 26 + [0x08, 0x07])
+POS_FAST_TEMPLATE = cmd_template([0xCA, 0, 0, 0, 0, 0x39] + [0] * 12 + [0] * 26 + [0xA4, 0x07])
+#     that second-to-last byte seems uninterpreted so far.
+SET_OFFSET_TEMPLATE = cmd_template([0xC8, 0, 0, 0, 0, 0])
+
+def cmd_pos_slow(x=0, y=0, z=0):
+    return pack_frame(POS_SLOW_TEMPLATE, 6, x/0.05, y/0.05, z/0.05)
+
+def cmd_pos_fast(x=0, y=0, z=0):
+    return pack_frame(POS_FAST_TEMPLATE, 6, x/0.05, y/0.05, z/0.05)
+
+@frame_cache
+def cmd_move(dir="none", step=False):
+    dirs = {"right": 0x01, "left": 0x02, "back": 0x04, "forward": 0x08, "up": 0x10, "down": 0x20, "none": 0, "stop": 0}
+    return cmd_append_checksum([0xBE, 0, 0, 0, 0x80, 1 if step else 0] + [dirs[dir]] + [0, 0, 0, 0x10, 0x0E] + [0] * 10 + [0x14 if step else 0])
+
+def cmd_set_offset(x=0, y=0, z=0):
+    return pack_frame(SET_OFFSET_TEMPLATE, 6, x/0.05, y/0.05, z/0.05)
+
+@frame_cache
+def cmd_spindle_on():
+    return cmd_append_checksum([0xB5, 0, 0, 0, 0x80, 0x02, 0x01, 0, 0, 0, 0x5F, 0xF0])
+
+@frame_cache
+def cmd_spindle_off():
+    return cmd_append_checksum([0xB5, 0, 0, 0, 0x80, 0x01, 0x01, 0, 0, 0, 0x5F, 0xF0])
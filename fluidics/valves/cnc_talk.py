@@ -1,15 +1,18 @@
 import usb
-import crccheck
 import time
 import sys
 import numpy
 import json
 import math
-
-import matplotlib.mlab
-import matplotlib.tri
+import os
+import hashlib
+import errno
+import threading
+import collections
 
 import cnc_commands
+from plate_interpolation import PlateInterpolator
+from trajectory import plan_trajectory, plan_duration, move_time, DEFAULT_KINEMATICS
 
 
 
@@ -46,6 +49,11 @@ import cnc_commands
 
 
 
+class CNCTimeout(Exception):
+    """Raised when the CNC controller does not finish a motion in time."""
+    pass
+
+
 def calculate_distance(start, end):
     dist = 0
     if start[0] is not None and end[0] is not None:
@@ -56,55 +64,80 @@ def calculate_distance(start, end):
         dist += (start[2] - end[2])**2
     return math.sqrt(dist)
 
-def max_distance_fix(positions, max_distance=1000):
-    out_positions = []
-    current_position = list(positions[0])
+class RealClock(object):
+    """Wall clock time."""
+    def time(self):
+        return time.time()
 
-    for end in positions[1:]:
-        d = calculate_distance(current_position, end)
+    def sleep(self, seconds):
+        time.sleep(seconds)
 
-        if d > max_distance:
-            parts = int(math.ceil(d/max_distance))
-            delta = [x - y if x is not None and y is not None else 0 for x, y in zip(end, current_position)]
-            for p in range(parts):
-                out_positions.append([c + d * (p+1)/float(parts) for d, c in zip(delta, current_position)])
-        else:
-            out_positions.append(end)
 
-        if end[0] is not None:
-            current_position[0] = end[0]
-        if end[1] is not None:
-            current_position[1] = end[1]
-        if end[2] is not None:
-            current_position[2] = end[2]
+class VirtualClock(object):
+    """A simulated clock: sleeping advances it immediately, so simulations run faster than real time."""
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def time(self):
+        return self.now
 
-    return out_positions
+    def sleep(self, seconds):
+        self.now += max(seconds, 0.0)
 
 
 class MockCNC(object):
-    def __init__(self, plates=2, plate_shape=(12, 8)):
+    """Simulated CNC: moves take the time the planner's kinematic model predicts, measured on self.clock."""
+    def __init__(self, plates=2, plate_shape=(12, 8), clock=None, verbose=False, well_cache_file=None):
         self.position = [0, 0, 0]
         self.plates = range(plates)
         self.plate_shape = plate_shape
         self.status = ("Initializing", True)
         self.wells = []
+        self.position_tolerance = 1.0
+        self.clock = VirtualClock() if clock is None else clock
+        self.verbose = verbose
+        self.well_cache_file = well_cache_file # cached well tables (None = always interpolate)
+        self.move_end = self.clock.time()
+        self.usb_latency = 0.002 # simulated USB round trip time (s)
+        self.set_kinematics()
         self.restore_config(r"./valves/VWR_Plate_Lid.json")
 
+    def set_kinematics(self, kinematics=DEFAULT_KINEMATICS):
+        """Set the trajectory.Kinematics used both to plan moves and to simulate them."""
+        self.kinematics = kinematics
+
+    def max_segment(self):
+        """Return the longest single move the controller accepts (None for no limit)."""
+        return None
+
+    def plan(self, start, waypoints):
+        """Return the timed plan (a list of trajectory.Step) that goes from start through the waypoints."""
+        return plan_trajectory(start, waypoints,
+                               kinematics=self.kinematics,
+                               max_segment=self.max_segment())
 
     def step_through(self, positions):
-        position = list(self.coords())
-        for p in max_distance_fix([position] + positions):
-            self.set(p)
+        for step in self.plan(list(self.coords()), positions):
+            self.set(step.position, step.fast)
 
     def coords(self, add_offset=True):
-        print "MockCNC queried for position = ", self.position
+        if self.verbose:
+            print "MockCNC queried for position = ", self.position
+        self.clock.sleep(self.usb_latency)
         return self.position
 
-    def set(self, position):
-        print "MockCNC setting position to", position
+    def set(self, position, fast=True):
+        """Send a (simulated) position packet and wait for the move to finish."""
+        if self.verbose:
+            print "MockCNC setting position to", position
+        self.clock.sleep(self.usb_latency)
+        self.move_end = self.clock.time() + move_time(self.position, position, fast, self.kinematics)
         self.position = list(position)
+        self.wait()
+        return self.position
 
-    def move(self, port, direction):
+    def find_target(self, port, direction=0):
+        """Return the plate and the well (x, y) on it that a move to port visits."""
         if isinstance(port, tuple):
             plate_name, port = port
             named_right = [p for p in self.plates if p.name == plate_name]
@@ -112,15 +145,39 @@ class MockCNC(object):
         else:
             plate = self.plates[direction]
 
-        plate.move(*map(int, self.wells[port].split()[1:]))
+        x, y = self.well_indices[port]
+        return plate, x, y
+
+    def plan_move(self, start, port, direction=0):
+        """Return the timed plan of a move to port starting from start."""
+        plate, x, y = self.find_target(port, direction)
+        return self.plan(start, plate.waypoints(x, y, start))
+
+    def plan_time(self, start, port, direction=0):
+        """Return the planned time (s) of a move from start to port and the final position."""
+        plan = self.plan_move(start, port, direction)
+        if not plan:
+            return 0.0, list(start)
+        return plan_duration(plan), list(plan[-1].position)
+
+    def move(self, port, direction):
+        plate, x, y = self.find_target(port, direction)
+        well = self.wells[port[1] if isinstance(port, tuple) else port]
+
+        plate.move(x, y)
         self.wait()
-        self.status = ("%s %s" % (plate.name, self.wells[port]), False)
+        self.status = ("%s %s" % (plate.name, well), False)
 
-    def get_wells(self):
+    def update_wells(self):
+        """Rebuild the list of well names (and their indices) offered for every plate."""
         self.wells = []
+        self.well_indices = []
         for plate in self.plates:
             for well in plate.locations():
                 self.wells.append("Well %d %d" % (well[0], well[1]))
+                self.well_indices.append((well[0], well[1]))
+
+    def get_wells(self):
         return self.wells
 
     def get_plates(self):
@@ -135,24 +192,135 @@ class MockCNC(object):
     def close(self):
         pass
 
-    def wait(self):
-        pass
+    def wait(self, poll_interval=0.01, timeout=60.0):
+        """Poll the simulated controller, one USB round trip per poll, until the current move has finished."""
+        end_time = self.clock.time() + timeout
+        self.clock.sleep(self.usb_latency)
+        remaining = self.move_end - self.clock.time()
+        if remaining <= 0:
+            return
+
+        # Skip straight to the poll that sees the move finished
+        period = poll_interval + self.usb_latency
+        polls_time = math.ceil(remaining / period) * period
+        if self.clock.time() + polls_time > end_time:
+            self.clock.sleep(end_time - self.clock.time())
+            raise CNCTimeout("CNC still busy after %0.1f s" % timeout)
+        self.clock.sleep(polls_time)
 
     def register_plate(self, plate):
         self.plates.append(plate)
+        self.update_wells()
 
     def write_config(self, path):
         with open(path, "w") as output_file:
             json.dump([p.save() for p in self.plates], output_file)
-    
+        self.write_well_cache()
+
     def restore_config(self, path):
+        """Load the plates of a configuration, reusing cached well tables whose calibration still matches."""
         with open(path) as input_file:
-            self.plates = [Plate(self, plate) for plate in json.load(input_file)]
+            configs = json.load(input_file)
+        well_cache = self.read_well_cache()
+        self.plates = [Plate(self, config, well_cache.get(config.get("name", ""))) for config in configs]
+        self.update_wells()
+        if any([plate.well_table is not None and well_cache.get(plate.name, {}).get("hash") != plate.calibration_hash()
+                for plate in self.plates]):
+            self.write_well_cache()
+
+    def read_well_cache(self):
+        """Return the cached well tables stored in well_cache_file, keyed by plate name."""
+        if self.well_cache_file is None or not os.path.isfile(self.well_cache_file):
+            return {}
+        try:
+            with open(self.well_cache_file) as cache_file:
+                return json.load(cache_file)
+        except (IOError, ValueError):
+            print "Could not read well cache:", self.well_cache_file
+            return {}
+
+    def write_well_cache(self):
+        """Store the well table of every calibrated plate in well_cache_file."""
+        if self.well_cache_file is None:
+            return
+        well_cache = {}
+        for plate in self.plates:
+            if plate.well_table is not None:
+                well_cache[plate.name] = {"hash": plate.calibration_hash(),
+                                          "wells": plate.well_table.tolist()}
+        try:
+            with open(self.well_cache_file, "w") as cache_file:
+                json.dump(well_cache, cache_file)
+        except IOError:
+            print "Could not write well cache:", self.well_cache_file
+
+
+class CNCReader(threading.Thread):
+    """Drain the IN endpoint of the CNC in the background.
+
+    Every frame is parsed with cnc_commands.parse_reply. The latest one (position,
+    busy and zeroed state) is published as a single (sequence, time, frame) tuple,
+    which is replaced in one assignment, so readers never need a lock. All frames
+    also go into a bounded ring buffer for telemetry.
+    """
+    def __init__(self, endpoint_in, history=1000, read_timeout=100):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.endpoint_in = endpoint_in
+        self.read_timeout = read_timeout # ms
+        self.frames = collections.deque(maxlen=history)
+        self.snapshot = (0, None, None)
+        self.running = True
+
+    def run(self):
+        sequence = 0
+        while self.running:
+            try:
+                msg = self.endpoint_in.read(64, self.read_timeout)
+            except usb.core.USBError as error:
+                if getattr(error, "errno", None) != errno.ETIMEDOUT:
+                    print "CNC read failed:", error
+                    time.sleep(0.1 * self.read_timeout / 1000.0)
+                continue
+            frame = cnc_commands.parse_reply(msg)
+            sequence += 1
+            self.snapshot = (sequence, time.time(), frame)
+            self.frames.append(self.snapshot)
+
+    def stop(self):
+        self.running = False
+
+    def latest(self):
+        """Return the most recent (sequence, time, frame) snapshot."""
+        return self.snapshot
+
+    def next_frame(self, sequence, timeout=1.0, poll_interval=0.001):
+        """Return the first frame received after the snapshot numbered sequence."""
+        end_time = time.time() + timeout
+        while True:
+            snapshot = self.snapshot
+            if snapshot[0] > sequence:
+                return snapshot[2]
+            if time.time() > end_time:
+                raise CNCTimeout("No reply from the CNC after %0.1f s" % timeout)
+            time.sleep(poll_interval)
+
+    def telemetry(self):
+        """Return the (sequence, time, frame) snapshots kept in the ring buffer, oldest first."""
+        return list(self.frames)
 
 
 class CNC(MockCNC):
-    def __init__(self, idVendor=0x2121, idProduct=0x2130, configuration=(0,0)):
+    def __init__(self, idVendor=0x2121, idProduct=0x2130, configuration=(0,0), well_cache_file=None):
         self.status = ("Initializing", False)
+        self.well_cache_file = well_cache_file # cached well tables (None = always interpolate)
+        self.absolute_moves = True # cleared if the controller repeatedly misses absolute targets
+        self.absolute_failures = 0 # consecutive absolute moves that ended off target
+        self.max_absolute_failures = 3
+        self.settle_reads = 3 # extra position reads before an absolute move counts as off target
+        self.position_tolerance = 1.0
+        self.clock = RealClock()
+        self.set_kinematics()
         import usb.core as usbcore
         self.dev = usbcore.find(idVendor=idVendor, idProduct=idProduct)
         import usb.backend.libusb0
@@ -164,6 +332,8 @@ class CNC(MockCNC):
             self.inf = self.cfg[configuration]
             self.endpoint_out = usb.util.find_descriptor(self.inf, custom_match = lambda e: usb.util.endpoint_direction(e.bEndpointAddress) == usb.util.ENDPOINT_OUT)
             self.endpoint_in = usb.util.find_descriptor(self.inf, custom_match = lambda e: usb.util.endpoint_direction(e.bEndpointAddress) == usb.util.ENDPOINT_IN)
+            self.reader = CNCReader(self.endpoint_in)
+            self.reader.start()
             self.send(cnc_commands.cmd_init_1())
             self.send(cnc_commands.cmd_init_2())
             self.send(cnc_commands.cmd_init_3())
@@ -180,24 +350,51 @@ class CNC(MockCNC):
             raise Exception, "Can't find device with vendor %0d and product %0d!" % (idVendor, idProduct)
 
     def send(self, msg):
-        assert len(msg) == 64
-        assert crccheck.crc.Crc8DvbS2.calc(map(ord, msg[:-1])) == ord(msg[-1])
+        assert len(msg) == 64 # the checksum is set when the frame is built
+        sequence = self.reader.latest()[0]
         self.endpoint_out.write(msg)
-        return self.receive()
+        return self.reader.next_frame(sequence)
 
     def receive(self):
-        return cnc_commands.parse_reply(self.endpoint_in.read(64))
+        """Return the next frame from the reader thread (never one received before the call)."""
+        return self.reader.next_frame(self.reader.latest()[0])
 
     def coords(self, add_offset=True):
-        received = self.receive()
+        """Return the latest position reported by the controller, without a USB transaction."""
+        received = self.reader.latest()[2]
+        if received is None:
+            received = self.receive()
         return (received["x"], received["y"], received["z"])
 
-    def set(self, position = (0, 0, 0)):
+    def close(self):
+        self.reader.stop()
+        self.reader.join()
+
+    def telemetry(self):
+        """Return the recent (sequence, time, frame) snapshots received from the controller."""
+        return self.reader.telemetry()
+
+    def set(self, position = (0, 0, 0), fast=True):
+        """Move to a position: a single absolute position packet when the controller honours it, else the offset trick."""
         current_position = self.coords()
         
         if position[0] is None:
             position = (current_position[0],current_position[1],-180) # changed -60 to -180
         print position
+
+        if self.absolute_moves:
+            reached = self.move_absolute(position, fast)
+            if calculate_distance(reached, position) <= self.position_tolerance:
+                self.absolute_failures = 0
+                return reached
+            self.absolute_failures += 1
+            if self.absolute_failures >= self.max_absolute_failures:
+                print "Absolute move ended at", reached, "instead of", position, "- using offset moves from now on"
+                self.absolute_moves = False
+            else:
+                print "Absolute move ended at", reached, "instead of", position, "- finishing with an offset move"
+            current_position = reached
+
         self.send(cnc_commands.cmd_set_offset(current_position[0]-position[0], current_position[1]-position[1], current_position[2]-position[2]))
         self.wait()
 
@@ -209,23 +406,72 @@ class CNC(MockCNC):
 
         return self.coords()
 
-    def wait(self):
-        while self.receive()["busy"]:
-            pass
+    def max_segment(self):
+        """Offset moves are limited to 1000 units, absolute moves are not."""
+        return None if self.absolute_moves else 1000
+
+    def move_absolute(self, position, fast=True):
+        """Move to a position with one cmd_pos_fast (or cmd_pos_slow) packet and return the settled position.
+
+        A reading that is still off target is taken again (after another wait, from a
+        fresh frame) up to settle_reads times, so a frame sent mid motion is not mistaken
+        for the end point.
+        """
+        if fast:
+            self.send(cnc_commands.cmd_pos_fast(position[0], position[1], position[2]))
+        else:
+            self.send(cnc_commands.cmd_pos_slow(position[0], position[1], position[2]))
+        self.wait()
+        reached = self.coords()
+        for read in range(self.settle_reads):
+            if calculate_distance(reached, position) <= self.position_tolerance:
+                break
+            self.wait()
+            received = self.receive()
+            reached = (received["x"], received["y"], received["z"])
+        return reached
+
+    def wait(self, poll_interval=0.01, timeout=60.0):
+        """Poll the controller at a bounded rate until it reports that it is not busy."""
+        end_time = time.time() + timeout
+        while self.reader.next_frame(self.reader.latest()[0], timeout)["busy"]:
+            if time.time() > end_time:
+                raise CNCTimeout("CNC still busy after %0.1f s" % timeout)
+            time.sleep(poll_interval)
 
 
 class Plate(object):
     """This represents a container with edges (e.g. 96 well plate) you want to pick on."""
-    def __init__(self, cnc=None, config={}):
+    def __init__(self, cnc=None, config={}, well_cache=None):
         self.cnc = cnc
         self.name = config["name"] if "name"  in config else ""
         self.height = config["height"] if "height" in config else None
+        self.hop_height = config["hop_height"] if "hop_height" in config else None
         self.positions = config["positions"] if "positions" in config else []
-        if len(self.positions) > 2:
+        self.method = config["interpolation"] if "interpolation" in config else "barycentric"
+        self.shape = (12, 8)
+        self.interpolation = None
+        self.well_table = None
+        if well_cache is not None and well_cache.get("hash") == self.calibration_hash():
+            self.well_table = numpy.array(well_cache["wells"], dtype=float)
+        elif len(self.positions) > 2:
             self.freeze()
-        else:
-            self.triangulation = None
-            self.interpolation = None
+        elif len(self.positions) == 1:
+            self.build_well_table()
+
+    def calibration_hash(self):
+        """Return a hash of the calibration points, used to validate cached well tables."""
+        calibration = json.dumps({"positions": self.positions, "shape": self.shape, "method": self.method}, sort_keys=True)
+        return hashlib.sha1(calibration).hexdigest()
+
+    def build_well_table(self):
+        """Compute the position of every well at once: well_table[x, y] is the (x, y, z) of well (x, y)."""
+        if len(self.positions) == 1:
+            self.well_table = numpy.tile(numpy.array(self.positions[0][2], dtype=float), self.shape + (1,))
+        elif self.interpolation is not None:
+            well_x, well_y = numpy.meshgrid(numpy.arange(self.shape[0]), numpy.arange(self.shape[1]), indexing="ij")
+            coords = self.interpolation(well_x, well_y)
+            self.well_table = coords.reshape(self.shape + (coords.shape[1],))
 
     def set_cnc(self, cnc):
         self.cnc = cnc
@@ -233,40 +479,71 @@ class Plate(object):
     def record_well(self, x = 0, y = 0):
         """Record the position of a single well for interpolation."""
         self.positions.append((x, y, self.cnc.coords(add_offset=True)))
+        self.interpolation = None
+        self.well_table = None
 
     def record_height(self):
         """Go up to the current z height from now on when exiting wells."""
         self.height = self.cnc.coords(add_offset=True)[2]
 
+    def record_hop_height(self):
+        """Go up to the current z height from now on when moving between wells of this plate."""
+        self.hop_height = self.cnc.coords(add_offset=True)[2]
+
     def freeze(self):
         """This takes the x, y, and z positions and solves the linear equations for positioning."""
         if len(self.positions) > 2:
             point = [p[:2] for p in self.positions]
-            point_x, point_y = zip(*point)
-
             coords = [p[2] for p in self.positions]
 
-            self.triangulation = matplotlib.tri.Triangulation(point_x, point_y)
-            self.interpolation = [matplotlib.tri.LinearTriInterpolator(self.triangulation, coord) for coord in zip(*coords)]
-            #self.interpolation = [matplotlib.tri.CubicTriInterpolator(self.triangulation, coord) for coord in zip(*coords)]
+            self.interpolation = PlateInterpolator(point, coords, self.method)
+            self.build_well_table()
+            if len(self.positions) > 3:
+                print "Plate %s calibration residuals from a plane:" % self.name, self.residuals()
         else:
             raise Exception, "Can't freeze positions with two or fewer!"
         
     def find_position(self, x=0, y=0):
+        if self.well_table is not None and x in range(self.shape[0]) and y in range(self.shape[1]):
+            return self.well_table[x, y].copy()
         if len(self.positions) == 1:
             return numpy.array(self.positions[0][2])
         elif len(self.positions) > 2:
             if self.interpolation is None:
                 print "Interpolator undefined, attempting to freeze positions matrix..."
                 self.freeze()
-            return numpy.array([interp(x, y) for interp in self.interpolation])
+            return self.interpolation(x, y)[0]
         else:
             # In theory you could support interpolation here
             raise Exception, "Can't find position if there are exactly two!"
 
-    def move(self, x=0, y=0):
+    def residuals(self):
+        """Return the distance of each calibration point from the least-squares plane through all of them."""
+        if self.interpolation is None:
+            self.freeze()
+        return self.interpolation.residuals()
+
+    def contains(self, position):
+        """Check if position is in one of the wells of this plate."""
+        if self.well_table is None:
+            return False
+        offsets = self.well_table.reshape(-1, 3) - numpy.array(position, dtype=float)
+        return numpy.sqrt((offsets ** 2).sum(axis=1)).min() <= self.cnc.position_tolerance
+
+    def waypoints(self, x=0, y=0, start=None):
+        """Return the waypoints of a move to well (x, y): lift, traverse and descend.
+
+        The needle is lifted to height, or only to hop_height (when set) if start is
+        already in a well of this plate, so it always clears the plate and its lid.
+        """
         target_position = self.find_position(x, y)
-        self.cnc.step_through([(None, None, self.height), (target_position[0], target_position[1], self.height), target_position])
+        lift_height = self.height
+        if self.hop_height is not None and start is not None and self.contains(start):
+            lift_height = self.hop_height
+        return [(None, None, lift_height), (target_position[0], target_position[1], lift_height), target_position]
+
+    def move(self, x=0, y=0):
+        self.cnc.step_through(self.waypoints(x, y, self.cnc.coords()))
 
     def home(self):
         """Home is above the first well."""
@@ -274,11 +551,14 @@ class Plate(object):
         self.cnc.step_through([(None, None, self.height), (target_position[0], target_position[1], self.height)])
 
     def save(self):
-        return {"height": self.height, "positions": self.positions, "name": self.name}
+        config = {"height": self.height, "positions": self.positions, "name": self.name, "interpolation": self.method}
+        if self.hop_height is not None:
+            config["hop_height"] = self.hop_height
+        return config
 
     def locations(self):
         locations = []
-        for i in range(0, 12):
-            for j in range(0, 8):
+        for i in range(0, self.shape[0]):
+            for j in range(0, self.shape[1]):
                 locations.append((i, j))
         return locations
@@ -10,9 +10,12 @@
 # ----------------------------------------------------------------------------------------
 # Import
 # ----------------------------------------------------------------------------------------
+import json
+import os
 import serial
 import sys
 import time
+from sc_library.latencyHistogram import LatencyHistogram
 
 # ----------------------------------------------------------------------------------------
 # HamiltonMVP Class Definition
@@ -21,15 +24,25 @@ class HamiltonMVP():
     def __init__(self,
                  com_port = 2,
                  num_simulated_valves = 0,
+                 topology_file = None,
+                 direction_overrides = {},
                  verbose = False):
 
         # Define attributes
         self.com_port = com_port
         self.verbose = verbose
         self.num_simulated_valves = num_simulated_valves
+        self.topology_file = topology_file  # cached chain topology (None = always probe)
+        self.direction_overrides = dict(direction_overrides) # valve_ID: fixed rotation direction
 
         # Determine simulation mode
         self.simulate = (self.num_simulated_valves > 0)
+
+        # Define response framing: a read returns as soon as a terminator arrives
+        self.read_timeout = 0.1         # default per-command deadline (s)
+        self.read_step = 0.01           # serial timeout of a single blocking read (s)
+        self.command_deadlines = {}     # per-command deadline overrides, e.g. {"LXR": 0.5}
+        self.latency = LatencyHistogram()
         
         # Create serial port (if not in simulation mode)
         if not self.simulate:
@@ -38,16 +51,20 @@ class HamiltonMVP():
                                  bytesize = serial.SEVENBITS, 
                                  parity = serial.PARITY_ODD, 
                                  stopbits = serial.STOPBITS_ONE, 
-                                 timeout = 0.1)
+                                 timeout = self.read_step)
         
         # Define important serial characters
         self.acknowledge = "\x06"
         self.carriage_return = "\x13"
         self.negative_acknowledge = "\x21"
-        self.read_length = 64
         self.char_offset = 97           # offset to convert int current_device
                                         # to ascii addresses (0=a, 1=b, ...)
 
+        # Define rotation directions: 0 and 1 are the LP0/LP1 direction flags
+        self.clockwise = 0              # increasing port number
+        self.counter_clockwise = 1      # decreasing port number
+        self.shortest_path = 2          # resolved to 0 or 1 before each move
+
         # Define valve and port properties
         self.max_valves = 16            # Maximum number of daisy chains
         self.valve_names = []
@@ -55,10 +72,13 @@ class HamiltonMVP():
         self.valve_configs = []
         self.max_ports_per_valve = []
         self.current_port = []
+        self.last_move_times = {}       # valve_ID: move time (s) measured by waitUntilNotMoving
 
-        # Configure device
-        self.autoAddress()
-        self.autoDetectValves()
+        # Configure device: verify the cached topology or probe the chain
+        if not self.restoreTopology():
+            self.autoAddress()
+            if self.autoDetectValves():
+                self.saveTopology()
         
     # ------------------------------------------------------------------------------------
     # Define Device Addresses: Must be First Command Issued
@@ -122,8 +142,8 @@ class HamiltonMVP():
 
             print "Initializing valves..."
             
-            # Wait for final device to stop moving
-            self.waitUntilNotMoving(self.num_valves-1)
+            # Wait for all devices to stop moving
+            self.waitUntilNotMoving()
             
             return True
         
@@ -140,11 +160,15 @@ class HamiltonMVP():
     # Change Port Position
     # ------------------------------------------------------------------------------------ 
     def changePort(self, valve_ID, port_ID, direction = 0, wait_until_done = False):
+        self.last_move_times = {}
+
         # Check validity if valve and port IDs
         if not self.isValidValve(valve_ID):
             return False
         if not self.isValidPort(valve_ID, port_ID):
             return False
+
+        direction = self.resolveDirection(valve_ID, port_ID, direction)
         
         if not self.simulate:
             # Compose message and increment port_ID (starts at 1)
@@ -158,18 +182,37 @@ class HamiltonMVP():
                 self.current_port[valve_ID] = port_ID
 
             if wait_until_done:
-                self.waitUntilNotMoving()
+                self.waitUntilNotMoving(valve_ID)
                 
             return response[1]
         else: ## simulation code
             self.current_port[valve_ID] = port_ID
             return True
 
+    # ------------------------------------------------------------------------------------
+    # Change the Port Position of Several Valves at Once: every move command is issued
+    # before any valve is waited on so that valves at different addresses rotate in
+    # parallel. moves is a list of (valve_ID, port_ID, direction). Returns the list of
+    # valve_IDs whose move was acknowledged.
+    # ------------------------------------------------------------------------------------
+    def changePorts(self, moves, wait_until_done = False):
+        start_time = time.time()
+        moved_valves = []
+        for [valve_ID, port_ID, direction] in moves:
+            if self.changePort(valve_ID, port_ID, direction = direction):
+                moved_valves.append(valve_ID)
+
+        if wait_until_done and not self.simulate:
+            self.waitUntilNotMoving(moved_valves, start_time = start_time)
+
+        return moved_valves
+
     # ------------------------------------------------------------------------------------
     # Close Serial Port
     # ------------------------------------------------------------------------------------ 
     def close(self):
         if not self.simulate:
+            self.saveTopology() # Record the last known ports
             self.serial.close()
             if self.verbose: print "Closed hamilton valves"
         else: ## simulation code
@@ -196,18 +239,28 @@ class HamiltonMVP():
     #  This function returns a response tuple used by this class
     #     (dictionary entry, affirmative response?, raw response string)
     # ------------------------------------------------------------------------------------
-    def inquireAndRespond(self, valve_ID, message, dictionary = {}, default = "Unknown"):
+    def inquireAndRespond(self, valve_ID, message, dictionary = {}, default = "Unknown", deadline = None):
 
         # Check if the valve_ID valve is initialized
         if not self.isValidValve(valve_ID):
             return ("", False, "")
+
+        # Determine command name (e.g. LQP, LPR) and the deadline for its response
+        command_name = self.commandName(message)
+        if deadline is None:
+            deadline = self.command_deadlines.get(command_name, self.read_timeout)
         
         # Prepend address of provided valve (0=a, 1=b, ...) 
         message = self.valve_names[valve_ID] + message
 
         # Write message and read response
+        self.serial.flushInput() # Discard any late bytes from a previous response
+        start_time = time.time()
         self.write(message)
-        response = self.read()
+        response = self.read(deadline)
+        self.latency.record(command_name,
+                            time.time() - start_time,
+                            timed_out = not self.isCompleteResponse(response))
         
         # Parse response into sent message and response
         repeated_message = response[:(response.find(self.carriage_return)-1)]
@@ -230,6 +283,12 @@ class HamiltonMVP():
         else:
             return (return_value, True, response)
                                 
+    # ------------------------------------------------------------------------------------
+    # Reduce a message to its command letters: used to key deadlines and latencies
+    # ------------------------------------------------------------------------------------
+    def commandName(self, message):
+        return "".join([character for character in message if character.isalpha()])
+
     # ------------------------------------------------------------------------------------
     # Generate Default Port Names
     # ------------------------------------------------------------------------------------  
@@ -247,7 +306,7 @@ class HamiltonMVP():
     def getRotationDirections(self, valve_ID):
         if not self.isValidValve(valve_ID):
             return ("")
-        return ("Clockwise", "Counter Clockwise")
+        return ("Clockwise", "Counter Clockwise", "Shortest Path")
 
     # ------------------------------------------------------------------------------------
     # Get Valve Status
@@ -255,6 +314,12 @@ class HamiltonMVP():
     def getStatus(self, valve_ID):
         return (self.whereIsValve(valve_ID), not self.isMovementFinished(valve_ID))
 
+    # ------------------------------------------------------------------------------------
+    # Return a printable summary of the measured command round trip times
+    # ------------------------------------------------------------------------------------
+    def getLatencyReport(self):
+        return self.latency.report()
+
     # ------------------------------------------------------------------------------------
     # Poll Valve Configuration
     # ------------------------------------------------------------------------------------  
@@ -292,21 +357,29 @@ class HamiltonMVP():
                                               default = "Unknown response")
             return response[0]
         else: ## simulation code
-            return ("Y", True, "Simulation")
+            return True
 
     # ------------------------------------------------------------------------------------
     # Poll Overload Status of Valve
     # ------------------------------------------------------------------------------------       
     def isValveOverloaded(self, valve_ID):
         if not self.simulate:
-            return self.inquireAndRespond(valve_ID,
-                                          message ="G\r",
-                                          dictionary = {"*": False,
-                                                        "N": False,
-                                                        "Y": True},
-                                          default = "Unknown response")
+            response = self.inquireAndRespond(valve_ID,
+                                              message ="G\r",
+                                              dictionary = {"*": False,
+                                                            "N": False,
+                                                            "Y": True},
+                                              default = "Unknown response")
+            return response[0]
         else: ## simulation code
-            return ("N", False, "Simulation")
+            return False
+
+    # ------------------------------------------------------------------------------------
+    # Check if a response is a complete frame
+    # ------------------------------------------------------------------------------------
+    def isCompleteResponse(self, response):
+        return (response.endswith(self.carriage_return) or
+                response in (self.acknowledge, self.negative_acknowledge))
 
     # ------------------------------------------------------------------------------------
     # Check if Port is Valid
@@ -344,10 +417,61 @@ class HamiltonMVP():
                 "4 ports": 4}.get(configuration_string, 0)
     
     # ------------------------------------------------------------------------------------
-    # Read from Serial Port
+    # Convert Port Configuration String to the Angle (degrees) Between Adjacent Ports
+    # ------------------------------------------------------------------------------------
+    def portSpacingPerConfiguration(self, configuration_string):
+        return {"8 ports": 45,
+                "6 ports": 60,
+                "3 ports": 90,
+                "2 ports @180": 180,
+                "2 ports @90": 90,
+                "4 ports": 90}.get(configuration_string, 0)
+
+    # ------------------------------------------------------------------------------------
+    # Number of port positions passed when rotating from one port to another in the
+    # given direction (0 = increasing port number, 1 = decreasing port number)
+    # ------------------------------------------------------------------------------------
+    def portDistance(self, valve_ID, from_port_ID, to_port_ID, direction = 0):
+        spacing = self.portSpacingPerConfiguration(self.whatIsValveConfiguration(valve_ID))
+        if spacing == 0:
+            return 0
+        return self.rotationAngle(valve_ID, from_port_ID, to_port_ID, direction) / spacing
+
+    # ------------------------------------------------------------------------------------
+    # Query the Current Port of a Valve: returns the port_ID (starts at 0) or None
+    # ------------------------------------------------------------------------------------
+    def queryPort(self, valve_ID):
+        if self.simulate:
+            return self.current_port[valve_ID]
+        response = self.inquireAndRespond(valve_ID,
+                                          message ="LQP\r",
+                                          dictionary = dict([(str(port_ID + 1), port_ID) for port_ID in range(8)]),
+                                          default = None)
+        if response[1] and (response[0] in range(8)): # not an (negative) acknowledge
+            return response[0]
+        return None
+
     # ------------------------------------------------------------------------------------
-    def read(self):
-        response = self.serial.read(self.read_length)
+    # Read a response frame from the serial port: returns as soon as the terminator
+    # arrives, or a bare acknowledge/negative acknowledge is followed by silence, or
+    # the deadline (s) expires
+    # ------------------------------------------------------------------------------------
+    def read(self, deadline = None):
+        if deadline is None:
+            deadline = self.read_timeout
+        end_time = time.time() + deadline
+
+        response = ""
+        while True:
+            new_characters = self.serial.read(max(1, self.serial.inWaiting()))
+            response += new_characters
+            if response.endswith(self.carriage_return):
+                break
+            if (not new_characters) and (response in (self.acknowledge, self.negative_acknowledge)):
+                break
+            if time.time() >= end_time:
+                break
+
         if self.verbose:
             print "Received: " + str((response, ""))
         return response
@@ -361,19 +485,155 @@ class HamiltonMVP():
         self.num_valves = 0
         self.valve_configs = []
         self.max_ports_per_valve = []
+        self.current_port = []
 
         # Configure Device
         self.autoAddress()
-        self.autoDetectValves()
+        if self.autoDetectValves():
+            self.saveTopology()
+
+    # ------------------------------------------------------------------------------------
+    # Resolve the rotation direction of a move: a per-valve override wins, then a
+    # shortest path request is resolved from the current (or given) port
+    # ------------------------------------------------------------------------------------
+    def resolveDirection(self, valve_ID, port_ID, direction, from_port_ID = None):
+        if valve_ID in self.direction_overrides:
+            return self.direction_overrides[valve_ID]
+        if not (direction == self.shortest_path):
+            return direction
+        if from_port_ID is None:
+            if not valve_ID < len(self.current_port):
+                return self.clockwise
+            from_port_ID = self.current_port[valve_ID]
+        clockwise_angle = self.rotationAngle(valve_ID, from_port_ID, port_ID, self.clockwise)
+        counter_clockwise_angle = self.rotationAngle(valve_ID, from_port_ID, port_ID, self.counter_clockwise)
+        if counter_clockwise_angle < clockwise_angle:
+            return self.counter_clockwise
+        else:
+            return self.clockwise
+
+    # ------------------------------------------------------------------------------------
+    # Restore Chain Topology from the Topology File: each cached valve is verified with
+    # a configuration query and its port is read back with a position query (the cached
+    # ports are stale after a crash or a manual move). Returns False (and leaves the
+    # chain unconfigured) if there is no cached topology or it does not match the chain.
+    # ------------------------------------------------------------------------------------
+    def restoreTopology(self):
+        if self.simulate or (self.topology_file is None) or (not os.path.isfile(self.topology_file)):
+            return False
+
+        try:
+            with open(self.topology_file) as topology_file:
+                topology = json.load(topology_file)
+            valve_names = [str(name) for name in topology["valve_names"]]
+            valve_configs = [str(config) for config in topology["valve_configs"]]
+            max_ports_per_valve = [int(max_ports) for max_ports in topology["max_ports_per_valve"]]
+            current_port = [int(port_ID) for port_ID in topology["current_port"]]
+            com_port = topology["com_port"]
+        except (IOError, ValueError, KeyError, TypeError):
+            print "Could not read valve topology: " + str(self.topology_file)
+            return False
+
+        num_valves = len(valve_configs)
+        if ((com_port != self.com_port) or (num_valves == 0) or
+            not (len(valve_names) == len(max_ports_per_valve) == len(current_port) == num_valves)):
+            print "Cached valve topology does not match; probing valve chain"
+            return False
+
+        # Verify each valve and read its actual port
+        self.valve_names = valve_names
+        for valve_ID in range(num_valves):
+            if not (self.howIsValveConfigured(valve_ID) == valve_configs[valve_ID]):
+                print "Valve " + str(valve_ID + 1) + " does not match cached topology; probing valve chain"
+                self.valve_names = []
+                return False
+            port_ID = self.queryPort(valve_ID)
+            if (port_ID is None) or not (port_ID < max_ports_per_valve[valve_ID]):
+                print "Could not read the port of valve " + str(valve_ID + 1) + "; probing valve chain"
+                self.valve_names = []
+                return False
+            if self.verbose and not (port_ID == current_port[valve_ID]):
+                print "Valve " + str(valve_ID + 1) + " is at port " + str(port_ID + 1) + ", not the cached port " + str(current_port[valve_ID] + 1)
+            current_port[valve_ID] = port_ID
+
+        self.num_valves = num_valves
+        self.valve_configs = valve_configs
+        self.max_ports_per_valve = max_ports_per_valve
+        self.current_port = current_port
+
+        print "----------------------------------------------------------------------"
+        print "Restored the Hamilton MVP Valve Daisy Chain"
+        print "   " + "COM Port: " + str(self.com_port)
+        print "   " + "Topology: " + str(self.topology_file)
+        for valve_ID in range(self.num_valves):
+            print "   " + "Device " + self.valve_names[valve_ID] + " is configured with " + self.valve_configs[valve_ID]
+        return True
+
+    # ------------------------------------------------------------------------------------
+    # Angle (degrees) rotated when moving from one port to another in the given direction
+    # ------------------------------------------------------------------------------------
+    def rotationAngle(self, valve_ID, from_port_ID, to_port_ID, direction = 0):
+        spacing = self.portSpacingPerConfiguration(self.whatIsValveConfiguration(valve_ID))
+        angle = (spacing * (to_port_ID - from_port_ID)) % 360
+        if direction == self.counter_clockwise:
+            angle = (360 - angle) % 360
+        return angle
+
+    # ------------------------------------------------------------------------------------
+    # Save Chain Topology to the Topology File
+    # ------------------------------------------------------------------------------------
+    def saveTopology(self):
+        if self.simulate or (self.topology_file is None) or (self.num_valves == 0):
+            return
+        topology = {"com_port": self.com_port,
+                    "valve_names": self.valve_names[:self.num_valves],
+                    "valve_configs": self.valve_configs,
+                    "max_ports_per_valve": self.max_ports_per_valve,
+                    "current_port": self.current_port}
+        try:
+            with open(self.topology_file, "w") as topology_file:
+                json.dump(topology, topology_file)
+        except IOError:
+            print "Could not save valve topology: " + str(self.topology_file)
     
     # ------------------------------------------------------------------------------------
-    # Halt Hamilton Class Until Movement is Finished
+    # Halt Hamilton Class Until Movement is Finished: valve_ID may be a single valve, a
+    # list of valves, or None (all valves). Polls quickly at first and then backs off
+    # exponentially up to max_pause_time; each pass polls only the valves that are still
+    # moving. Returns the measured move time (s) of the slowest valve, or None if the
+    # timeout (s) expired. Per-valve move times are stored in last_move_times.
     # ------------------------------------------------------------------------------------
-    def waitUntilNotMoving(self, valve_ID, pause_time = 1):
-        doneMoving = False
-        while not doneMoving:
-            doneMoving = self.isMovementFinished(valve_ID)
+    def waitUntilNotMoving(self, valve_ID = None, pause_time = 0.02, max_pause_time = 0.5,
+                           backoff = 2.0, timeout = 30.0, start_time = None):
+        if valve_ID is None:
+            moving_valves = range(self.num_valves)
+        elif isinstance(valve_ID, (list, tuple)):
+            moving_valves = list(valve_ID)
+        else:
+            moving_valves = [valve_ID]
+
+        if start_time is None:
+            start_time = time.time()
+        end_time = start_time + timeout
+        self.last_move_times = {}
+
+        while True:
+            still_moving = []
+            for moving_valve in moving_valves:
+                if self.isMovementFinished(moving_valve) == True:
+                    self.last_move_times[moving_valve] = time.time() - start_time
+                else:
+                    still_moving.append(moving_valve)
+            moving_valves = still_moving
+
+            if len(moving_valves) == 0:
+                return max(self.last_move_times.values() + [0.0])
+            if time.time() + pause_time > end_time:
+                print "Valves did not finish moving: " + str(moving_valves)
+                return None
+
             time.sleep(pause_time)
+            pause_time = min(pause_time * backoff, max_pause_time)
     
     # ------------------------------------------------------------------------------------
     # Poll Valve Configuration
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# ----------------------------------------------------------------------------------------
+# Benchmark and regression check of HamiltonMVP against the Hamilton MVP emulator: the
+# real driver talks to an emulated chain over a pseudo-terminal and the script reports
+# the command round trip times and the valve move times it measures.
+#
+# Usage (from the repository root):
+#   python -m fluidics.valves.hamiltonBenchmark [options] [valve type ...]
+#   options include the emulator options (e.g. --nak-rate 0.05, --move-time 0.1) and
+#   --round-trips / --moves to set the amount of work (--help lists them).
+# ----------------------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------------------
+# Import
+# ----------------------------------------------------------------------------------------
+import argparse
+import random
+import time
+from hamilton import HamiltonMVP
+from hamiltonEmulator import addEmulatorArguments, emulatorFromArguments
+
+# ----------------------------------------------------------------------------------------
+# Summarise a list of times (s) as a printable line in ms
+# ----------------------------------------------------------------------------------------
+def summarize(name, times):
+    if len(times) == 0:
+        return name + ": no samples"
+    times = sorted(times)
+    mean = sum(times) / len(times)
+    median = times[len(times) / 2]
+    return (name + ": " + str(len(times)) + " samples, mean " + "%0.1f" % (1000.0 * mean) +
+            " ms, median " + "%0.1f" % (1000.0 * median) + " ms, max " + "%0.1f" % (1000.0 * times[-1]) + " ms")
+
+# ----------------------------------------------------------------------------------------
+# Time status queries (one LQP and one F per valve and pass)
+# ----------------------------------------------------------------------------------------
+def benchmarkRoundTrips(valve_chain, num_round_trips):
+    times = []
+    for round_trip in range(num_round_trips):
+        for valve_ID in range(valve_chain.howManyValves()):
+            start_time = time.time()
+            valve_chain.getStatus(valve_ID)
+            times.append(time.time() - start_time)
+    return times
+
+# ----------------------------------------------------------------------------------------
+# Time random moves, issued one chain wide burst at a time. Returns the move times and
+# the number of moves that were not acknowledged or did not finish.
+# ----------------------------------------------------------------------------------------
+def benchmarkMoves(valve_chain, num_moves, rng):
+    times = []
+    failures = 0
+    for move in range(num_moves):
+        moves = []
+        for valve_ID in range(valve_chain.howManyValves()):
+            port_ID = rng.randrange(valve_chain.max_ports_per_valve[valve_ID])
+            direction = valve_chain.resolveDirection(valve_ID, port_ID, valve_chain.shortest_path)
+            moves.append((valve_ID, port_ID, direction))
+        moved_valves = valve_chain.changePorts(moves, wait_until_done = True)
+        failures += len(moves) - len(moved_valves)
+        for valve_ID in moved_valves:
+            if valve_ID in valve_chain.last_move_times:
+                times.append(valve_chain.last_move_times[valve_ID])
+            else:
+                failures += 1
+    return [times, failures]
+
+# ----------------------------------------------------------------------------------------
+# Run the benchmark
+# ----------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Benchmark HamiltonMVP against an emulated valve chain")
+    addEmulatorArguments(parser)
+    parser.add_argument("--round-trips", type = int, default = 50,
+                        help = "status queries per valve (default: 50)")
+    parser.add_argument("--moves", type = int, default = 20,
+                        help = "chain wide move bursts (default: 20)")
+    parser.add_argument("--seed", type = int, default = 0,
+                        help = "seed of the random target ports (default: 0)")
+    arguments = parser.parse_args()
+
+    emulator = emulatorFromArguments(arguments)
+    emulator.start()
+    try:
+        valve_chain = HamiltonMVP(com_port = emulator.port_name)
+        if valve_chain.howManyValves() == 0:
+            raise SystemExit("No valves detected on the emulated chain")
+
+        round_trip_times = benchmarkRoundTrips(valve_chain, arguments.round_trips)
+        [move_times, move_failures] = benchmarkMoves(valve_chain, arguments.moves, random.Random(arguments.seed))
+
+        print "----------------------------------------------------------------------"
+        print "Hamilton MVP benchmark: " + str(valve_chain.howManyValves()) + " valves, NAK rate " + str(arguments.nak_rate)
+        print summarize("Status round trips", round_trip_times)
+        print summarize("Valve moves", move_times)
+        print "Failed moves: " + str(move_failures)
+        print "Command latencies:"
+        print valve_chain.getLatencyReport()
+        valve_chain.close()
+    finally:
+        emulator.close()
+
+#
+# The MIT License
+#
+# Copyright (c) 2013 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
@@ -0,0 +1,298 @@
+#!/usr/bin/python
+# ----------------------------------------------------------------------------------------
+# An emulator of a Hamilton MVP daisy chain on a Linux pseudo-terminal. It speaks
+# the subset of the MVP protocol used by HamiltonMVP (1a, LXR, LQT, LQP, F, G and
+# LP<direction><port>R) with the same framing the driver parses, and models the
+# time a valve takes to rotate, the transmission delay of the serial link, and
+# occasional negative acknowledges. Point HamiltonMVP (com_port) at the printed
+# device to exercise the real serial code without hardware.
+#
+# Usage: python hamiltonEmulator.py [options] [valve type ...]
+#   valve types are LQT codes: 2 = 8 ports, 3 = 6 ports, 4 = 3 ports,
+#   5 = 2 ports @180, 6 = 2 ports @90, 7 = 4 ports (default: 2 2 2)
+#   options set the NAK rate and the timing model (--help lists them).
+#   hamiltonBenchmark.py runs HamiltonMVP against this emulator.
+# ----------------------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------------------
+# Import
+# ----------------------------------------------------------------------------------------
+import argparse
+import os
+import random
+import select
+import threading
+import time
+import tty
+
+# ----------------------------------------------------------------------------------------
+# EmulatedValve Class Definition
+# ----------------------------------------------------------------------------------------
+class EmulatedValve(object):
+
+    # Number of ports and angle between adjacent ports (degrees) for each LQT code
+    valve_types = {"2": (8, 45),
+                   "3": (6, 60),
+                   "4": (3, 90),
+                   "5": (2, 180),
+                   "6": (2, 90),
+                   "7": (4, 90)}
+
+    def __init__(self,
+                 valve_type = "2",
+                 move_time = 0.15,
+                 time_per_degree = 0.0015,
+                 initialize_time = 1.0):
+
+        # Define local attributes
+        self.valve_type = valve_type
+        [self.num_ports, self.port_spacing] = self.valve_types[valve_type]
+        self.move_time = move_time                  # fixed cost of a move (s)
+        self.time_per_degree = time_per_degree      # rotation cost (s/degree)
+        self.initialize_time = initialize_time      # time to home the valve (s)
+        self.port_ID = 0
+        self.move_end_time = 0.0
+        self.overloaded = False
+
+    # ------------------------------------------------------------------------------------
+    # Start a move to a port: returns False if the move is rejected
+    # ------------------------------------------------------------------------------------
+    def changePort(self, port_ID, direction):
+        if self.isMoving() or not (0 <= port_ID < self.num_ports) or not (direction in (0, 1)):
+            return False
+        angle = (self.port_spacing * (port_ID - self.port_ID)) % 360
+        if direction == 1:
+            angle = (360 - angle) % 360
+        self.move_end_time = time.time() + self.move_time + self.time_per_degree * angle
+        self.port_ID = port_ID
+        return True
+
+    # ------------------------------------------------------------------------------------
+    # Home the valve to port 1
+    # ------------------------------------------------------------------------------------
+    def initialize(self):
+        if self.isMoving():
+            return False
+        self.port_ID = 0
+        self.move_end_time = time.time() + self.initialize_time
+        return True
+
+    # ------------------------------------------------------------------------------------
+    # Check if the valve is rotating
+    # ------------------------------------------------------------------------------------
+    def isMoving(self):
+        return time.time() < self.move_end_time
+
+# ----------------------------------------------------------------------------------------
+# HamiltonEmulator Class Definition
+# ----------------------------------------------------------------------------------------
+class HamiltonEmulator(object):
+    def __init__(self,
+                 valve_types = ("2", "2", "2"),
+                 baud_rate = 9600,
+                 response_time = 0.002,
+                 nak_rate = 0.0,
+                 move_time = 0.15,
+                 time_per_degree = 0.0015,
+                 initialize_time = 1.0,
+                 addressed = False,
+                 verbose = False):
+
+        # Define local attributes
+        self.valves = [EmulatedValve(valve_type,
+                                     move_time = move_time,
+                                     time_per_degree = time_per_degree,
+                                     initialize_time = initialize_time) for valve_type in valve_types]
+        self.baud_rate = baud_rate
+        self.response_time = response_time          # command processing time (s)
+        self.nak_rate = nak_rate                    # probability of a spurious NAK
+        self.addressed = addressed                  # valves ignore commands until "1a"
+        self.verbose = verbose
+        self.thread = None
+        self.running = False
+
+        # Define important serial characters (as framed by HamiltonMVP)
+        self.acknowledge = "\x06"
+        self.carriage_return = "\x13"
+        self.negative_acknowledge = "\x21"
+        self.char_offset = 97
+
+        # Create the pseudo-terminal: the driver opens port_name
+        [self.master, self.slave] = os.openpty()
+        tty.setraw(self.slave)
+        self.port_name = os.ttyname(self.slave)
+
+    # ------------------------------------------------------------------------------------
+    # Close the pseudo-terminal
+    # ------------------------------------------------------------------------------------
+    def close(self):
+        self.stop()
+        os.close(self.master)
+        os.close(self.slave)
+
+    # ------------------------------------------------------------------------------------
+    # Compose the response to a single command (without the transmission delay).
+    # Returns None for commands the chain ignores.
+    # ------------------------------------------------------------------------------------
+    def handleCommand(self, command):
+        # Auto addressing is broadcast and acknowledged by the chain
+        if command == "1a":
+            self.addressed = True
+            return self.acknowledge
+
+        # Every other command starts with the address of a valve
+        if (not self.addressed) or (len(command) < 2):
+            return None
+        valve_ID = ord(command[0]) - self.char_offset
+        if not (0 <= valve_ID < len(self.valves)):
+            return None
+        valve = self.valves[valve_ID]
+        command = command[1:]
+
+        if random.random() < self.nak_rate:
+            return self.negative_acknowledge + self.carriage_return
+
+        if command == "LXR":
+            reply = valve.initialize()
+        elif command.startswith("LP") and command.endswith("R") and len(command) > 4:
+            try:
+                reply = valve.changePort(int(command[3:-1]) - 1, int(command[2]))
+            except ValueError:
+                reply = False
+        elif command == "LQT":
+            return self.acknowledge + valve.valve_type + self.carriage_return
+        elif command == "LQP":
+            return self.acknowledge + str(valve.port_ID + 1) + self.carriage_return
+        elif command == "F":
+            return self.acknowledge + ("N" if valve.isMoving() else "Y") + self.carriage_return
+        elif command == "G":
+            return self.acknowledge + ("Y" if valve.overloaded else "N") + self.carriage_return
+        else:
+            reply = False
+
+        if reply:
+            return self.acknowledge + self.carriage_return
+        else:
+            return self.negative_acknowledge + self.carriage_return
+
+    # ------------------------------------------------------------------------------------
+    # Serve commands until stopped: commands are terminated by a carriage return
+    # ------------------------------------------------------------------------------------
+    def run(self):
+        buffer = ""
+        while self.running:
+            [readable, writable, errors] = select.select([self.master], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                buffer += os.read(self.master, 1024)
+            except OSError:
+                break
+            while "\r" in buffer:
+                [command, buffer] = buffer.split("\r", 1)
+                response = self.handleCommand(command)
+                if self.verbose:
+                    print "Emulator received: " + repr(command) + " replied: " + repr(response)
+                if response is None:
+                    continue
+
+                # Model command processing and the time to transmit the command and
+                # response (10 bits per character: start, 7 data, parity, stop)
+                time.sleep(self.response_time +
+                           10.0 * (len(command) + 1 + len(response)) / self.baud_rate)
+                os.write(self.master, response)
+
+    # ------------------------------------------------------------------------------------
+    # Start serving in a background thread
+    # ------------------------------------------------------------------------------------
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target = self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    # ------------------------------------------------------------------------------------
+    # Stop the background thread
+    # ------------------------------------------------------------------------------------
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+# ----------------------------------------------------------------------------------------
+# Add the emulator options to an argparse parser
+# ----------------------------------------------------------------------------------------
+def addEmulatorArguments(parser):
+    parser.add_argument("valve_types", nargs = "*", default = ["2", "2", "2"],
+                        help = "LQT code of each valve (default: 2 2 2)")
+    parser.add_argument("--nak-rate", type = float, default = 0.0,
+                        help = "probability of a spurious NAK (default: 0)")
+    parser.add_argument("--baud-rate", type = int, default = 9600,
+                        help = "modelled serial speed (default: 9600)")
+    parser.add_argument("--response-time", type = float, default = 0.002,
+                        help = "command processing time in s (default: 0.002)")
+    parser.add_argument("--move-time", type = float, default = 0.15,
+                        help = "fixed cost of a valve move in s (default: 0.15)")
+    parser.add_argument("--time-per-degree", type = float, default = 0.0015,
+                        help = "rotation cost in s/degree (default: 0.0015)")
+    parser.add_argument("--initialize-time", type = float, default = 1.0,
+                        help = "time to home a valve in s (default: 1.0)")
+
+# ----------------------------------------------------------------------------------------
+# Create an emulator from parsed options
+# ----------------------------------------------------------------------------------------
+def emulatorFromArguments(arguments, verbose = False):
+    for valve_type in arguments.valve_types:
+        if not valve_type in EmulatedValve.valve_types:
+            raise ValueError("Unknown valve type: " + valve_type)
+    return HamiltonEmulator(valve_types = arguments.valve_types,
+                            baud_rate = arguments.baud_rate,
+                            response_time = arguments.response_time,
+                            nak_rate = arguments.nak_rate,
+                            move_time = arguments.move_time,
+                            time_per_degree = arguments.time_per_degree,
+                            initialize_time = arguments.initialize_time,
+                            verbose = verbose)
+
+# ----------------------------------------------------------------------------------------
+# Run the emulator until interrupted
+# ----------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Emulate a Hamilton MVP valve chain on a pseudo-terminal")
+    addEmulatorArguments(parser)
+    parser.add_argument("--quiet", action = "store_true", help = "do not print every command")
+    arguments = parser.parse_args()
+    emulator = emulatorFromArguments(arguments, verbose = not arguments.quiet)
+    emulator.start()
+    print "Emulating " + str(len(emulator.valves)) + " Hamilton MVP valves on " + emulator.port_name
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        emulator.close()
+
+#
+# The MIT License
+#
+# Copyright (c) 2013 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
@@ -0,0 +1,164 @@
+#!/usr/bin/python
+# ----------------------------------------------------------------------------------------
+# A lightweight model of how long valve and CNC moves actually take. Measured move
+# times are accumulated per key (e.g. one key per valve and rotation direction, one
+# key for the CNC) as running sums, from which a linear fit of time versus move
+# size (ports for valves, planned trajectory time for the CNC) and its residual
+# spread are computed on demand. The sums are saved to a small JSON file so the
+# model keeps learning across sessions.
+# ----------------------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------------------
+# Import
+# ----------------------------------------------------------------------------------------
+import json
+import math
+import os
+import threading
+
+# ----------------------------------------------------------------------------------------
+# MoveTimeModel Class Definition
+# ----------------------------------------------------------------------------------------
+class MoveTimeModel(object):
+
+    # Prior (intercept (s), slope (s/port or s/planned s), standard deviation (s)) used
+    # until enough moves of a given kind have been measured: CNC moves are assumed to
+    # take the time the trajectory planner predicts
+    priors = {"valve": (0.5, 0.1, 0.5),
+              "cnc": (0.0, 1.0, 1.0)}
+
+    def __init__(self,
+                 model_file = None,
+                 min_samples = 3,
+                 verbose = False):
+
+        # Define local attributes
+        self.model_file = model_file
+        self.min_samples = min_samples
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.sums = {} # key: [n, sum_x, sum_y, sum_xx, sum_xy, sum_yy]
+
+        self.load()
+
+    # ------------------------------------------------------------------------------------
+    # Record a measured move: key identifies the kind of move, distance is in ports
+    # (valves) or planned seconds (CNC), seconds is the measured duration
+    # ------------------------------------------------------------------------------------
+    def addSample(self, key, distance, seconds):
+        if seconds is None or seconds < 0:
+            return
+        x = float(distance)
+        y = float(seconds)
+        with self.lock:
+            sums = self.sums.setdefault(key, [0, 0.0, 0.0, 0.0, 0.0, 0.0])
+            sums[0] += 1
+            sums[1] += x
+            sums[2] += y
+            sums[3] += x * x
+            sums[4] += x * y
+            sums[5] += y * y
+        if self.verbose:
+            print "Measured " + key + ": " + str(distance) + " in " + "%0.3f" % seconds + " s"
+
+    # ------------------------------------------------------------------------------------
+    # Estimate the duration of a move: returns (mean (s), variance (s^2))
+    # ------------------------------------------------------------------------------------
+    def estimate(self, key, distance):
+        [intercept, slope, std] = self.getFit(key)
+        return (max(intercept + slope * float(distance), 0.0), std * std)
+
+    # ------------------------------------------------------------------------------------
+    # Return the (intercept, slope, residual standard deviation) fit for a key
+    # ------------------------------------------------------------------------------------
+    def getFit(self, key):
+        prior = self.priors.get(key.split()[0], self.priors["valve"])
+        with self.lock:
+            sums = list(self.sums.get(key, [0, 0.0, 0.0, 0.0, 0.0, 0.0]))
+        [n, sum_x, sum_y, sum_xx, sum_xy, sum_yy] = sums
+        if n < self.min_samples:
+            return prior
+
+        mean_x = sum_x / n
+        mean_y = sum_y / n
+        s_xx = sum_xx - n * mean_x * mean_x
+        s_xy = sum_xy - n * mean_x * mean_y
+        s_yy = sum_yy - n * mean_y * mean_y
+
+        # Fall back to a constant model if all moves had the same distance
+        if s_xx > 1e-12:
+            slope = s_xy / s_xx
+            num_parameters = 2
+        else:
+            slope = 0.0
+            num_parameters = 1
+        intercept = mean_y - slope * mean_x
+
+        residual = max(s_yy - slope * s_xy, 0.0)
+        if n > num_parameters:
+            std = math.sqrt(residual / (n - num_parameters))
+        else:
+            std = prior[2]
+        return (intercept, slope, std)
+
+    # ------------------------------------------------------------------------------------
+    # Load accumulated sums from the model file
+    # ------------------------------------------------------------------------------------
+    def load(self):
+        if (self.model_file is None) or (not os.path.isfile(self.model_file)):
+            return
+        try:
+            with open(self.model_file) as model_file:
+                sums = json.load(model_file)
+            with self.lock:
+                self.sums = dict([(str(key), [int(value[0])] + [float(v) for v in value[1:6]])
+                                  for [key, value] in sums.items()])
+        except (IOError, ValueError, TypeError, IndexError, AttributeError):
+            print "Could not read move time model: " + str(self.model_file)
+
+    # ------------------------------------------------------------------------------------
+    # Save accumulated sums to the model file
+    # ------------------------------------------------------------------------------------
+    def save(self):
+        if self.model_file is None:
+            return
+        with self.lock:
+            sums = dict(self.sums)
+        try:
+            with open(self.model_file, "w") as model_file:
+                json.dump(sums, model_file)
+        except IOError:
+            print "Could not save move time model: " + str(self.model_file)
+
+# ----------------------------------------------------------------------------------------
+# Model keys
+# ----------------------------------------------------------------------------------------
+def cncKey():
+    return "cnc planned"
+
+def valveKey(valve_ID, direction):
+    return "valve " + str(valve_ID) + " " + str(direction)
+
+#
+# The MIT License
+#
+# Copyright (c) 2013 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
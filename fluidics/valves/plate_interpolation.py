@@ -0,0 +1,121 @@
+"""
+Interpolation of CNC coordinates between the calibrated wells of a plate.
+
+A plate is calibrated by recording the CNC (x, y, z) position of a few wells
+(usually three or four corners). The position of any other well is then
+interpolated from those points, either with a least-squares plane (affine) fit
+or piecewise linearly over a Delaunay triangulation of the calibration points
+(barycentric interpolation). Only NumPy is required.
+"""
+
+import numpy
+
+
+def fit_plane(points, values):
+    """Least-squares fit of values = a + b * x + c * y for every column of values.
+
+    points is an (n, 2) array of well indices and values an (n, m) array of
+    coordinates. Returns the (3, m) coefficient array.
+    """
+    points = numpy.asarray(points, dtype=float)
+    design = numpy.column_stack([numpy.ones(len(points)), points[:, 0], points[:, 1]])
+    return numpy.linalg.lstsq(design, numpy.asarray(values, dtype=float), rcond=-1)[0]
+
+
+def evaluate_plane(coefficients, x, y):
+    """Evaluate a plane fit at the points (x, y): returns an (n, m) array."""
+    x = numpy.asarray(x, dtype=float).ravel()
+    y = numpy.asarray(y, dtype=float).ravel()
+    return numpy.column_stack([numpy.ones(len(x)), x, y]).dot(coefficients)
+
+
+def circumcircle_contains(points, triangle, point):
+    """Check if point lies strictly inside the circumcircle of a triangle (indices into points)."""
+    (ax, ay), (bx, by), (cx, cy) = [points[i] for i in triangle]
+    d = 2.0 * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
+    if abs(d) < 1e-12:
+        return False
+    ux = ((ax * ax + ay * ay) * (by - cy) + (bx * bx + by * by) * (cy - ay) + (cx * cx + cy * cy) * (ay - by)) / d
+    uy = ((ax * ax + ay * ay) * (cx - bx) + (bx * bx + by * by) * (ax - cx) + (cx * cx + cy * cy) * (bx - ax)) / d
+    radius_squared = (ax - ux) ** 2 + (ay - uy) ** 2
+    return (point[0] - ux) ** 2 + (point[1] - uy) ** 2 < radius_squared * (1.0 - 1e-9)
+
+
+def delaunay(points):
+    """Delaunay triangulation of a handful of 2D points (Bowyer-Watson).
+
+    Returns a list of (i, j, k) index triples. Collinear input gives no triangles.
+    """
+    points = [(float(p[0]), float(p[1])) for p in points]
+    num_points = len(points)
+    if num_points < 3:
+        return []
+
+    # Start from a triangle that encloses every point
+    xs, ys = zip(*points)
+    span = max(max(xs) - min(xs), max(ys) - min(ys), 1.0) * 10.0
+    mid_x = 0.5 * (max(xs) + min(xs))
+    mid_y = 0.5 * (max(ys) + min(ys))
+    vertices = points + [(mid_x - 2.0 * span, mid_y - span), (mid_x, mid_y + 2.0 * span), (mid_x + 2.0 * span, mid_y - span)]
+    triangles = [(num_points, num_points + 1, num_points + 2)]
+
+    for index, point in enumerate(points):
+        bad_triangles = [t for t in triangles if circumcircle_contains(vertices, t, point)]
+
+        # The boundary of the cavity is made of the edges used by exactly one bad triangle
+        edge_counts = {}
+        for t in bad_triangles:
+            for edge in ((t[0], t[1]), (t[1], t[2]), (t[2], t[0])):
+                key = tuple(sorted(edge))
+                edge_counts[key] = edge_counts.get(key, 0) + 1
+
+        triangles = [t for t in triangles if t not in bad_triangles]
+        triangles += [(edge[0], edge[1], index) for edge, count in edge_counts.items() if count == 1]
+
+    return [t for t in triangles if max(t) < num_points]
+
+
+class PlateInterpolator(object):
+    """Interpolate CNC coordinates from calibration points.
+
+    method is "barycentric" (piecewise linear over a Delaunay triangulation, the
+    plane fit is used outside of it) or "plane" (least-squares affine fit).
+    """
+    def __init__(self, points, values, method="barycentric"):
+        self.points = numpy.asarray(points, dtype=float)
+        self.values = numpy.asarray(values, dtype=float)
+        self.method = method
+        self.plane = fit_plane(self.points, self.values)
+        self.triangles = delaunay(self.points) if method == "barycentric" else []
+
+    def __call__(self, x, y):
+        """Return the interpolated coordinates at (x, y): one row per point."""
+        x = numpy.asarray(x, dtype=float).ravel()
+        y = numpy.asarray(y, dtype=float).ravel()
+        result = evaluate_plane(self.plane, x, y)
+        unassigned = numpy.ones(len(x), dtype=bool)
+        for triangle in self.triangles:
+            (ax, ay), (bx, by), (cx, cy) = self.points[list(triangle)]
+            d = (by - cy) * (ax - cx) + (cx - bx) * (ay - cy)
+            if abs(d) < 1e-12:
+                continue
+            l1 = ((by - cy) * (x - cx) + (cx - bx) * (y - cy)) / d
+            l2 = ((cy - ay) * (x - cx) + (ax - cx) * (y - cy)) / d
+            l3 = 1.0 - l1 - l2
+            inside = unassigned & (l1 >= -1e-9) & (l2 >= -1e-9) & (l3 >= -1e-9)
+            if inside.any():
+                corners = self.values[list(triangle)]
+                result[inside] = (numpy.outer(l1[inside], corners[0]) +
+                                  numpy.outer(l2[inside], corners[1]) +
+                                  numpy.outer(l3[inside], corners[2]))
+                unassigned &= ~inside
+        return result
+
+    def residuals(self):
+        """Return the distance between each calibration point and the plane fit.
+
+        Large residuals mean the plate is not flat (or a well was recorded badly).
+        The barycentric interpolation passes through the calibration points exactly.
+        """
+        fitted = evaluate_plane(self.plane, self.points[:, 0], self.points[:, 1])
+        return numpy.sqrt(((fitted - self.values) ** 2).sum(axis=1))
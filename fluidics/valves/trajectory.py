@@ -0,0 +1,133 @@
+"""
+Plan the CNC moves needed to reach a sequence of waypoints.
+
+A waypoint is an (x, y, z) position in which any coordinate may be None to keep
+the current value. The planner resolves the waypoints, drops zero length moves,
+merges consecutive collinear moves, and then splits the path into timed steps:
+long hops use cmd_pos_fast and the last stretch before the final target is
+taken with cmd_pos_slow. Step durations come from a single Kinematics model,
+which MockCNC also uses to simulate moves, so the resulting plan both drives
+the CNC (or MockCNC) and estimates how long a move will take.
+"""
+
+import collections
+import math
+
+
+## A single move: go to position at fast or slow speed, taking duration seconds.
+Step = collections.namedtuple("Step", ["position", "fast", "length", "duration"])
+
+## Motion limits of the CNC: per axis max_velocity (units / s) and acceleration
+## (units / s^2), the fraction of max_velocity used by slow moves, the distance
+## before the final target that is approached slowly and the settling time (s)
+## after each move.
+Kinematics = collections.namedtuple("Kinematics", ["max_velocity", "acceleration", "slow_fraction",
+                                                   "slow_distance", "settle_time"])
+
+DEFAULT_KINEMATICS = Kinematics(max_velocity=(100.0, 100.0, 50.0),
+                                acceleration=(500.0, 500.0, 250.0),
+                                slow_fraction=0.2,
+                                slow_distance=50.0,
+                                settle_time=0.05)
+
+
+def resolve_waypoints(start, waypoints):
+    """Fill in the None coordinates of each waypoint from the previous position."""
+    resolved = []
+    current = list(start)
+    for waypoint in waypoints:
+        current = [c if w is None else float(w) for w, c in zip(waypoint, current)]
+        resolved.append(tuple(current))
+    return resolved
+
+
+def merge_collinear(start, positions, tolerance=1e-6):
+    """Drop repeated positions and positions lying on the straight line between their neighbours."""
+    merged = []
+    previous = tuple(start)
+    for position in positions:
+        if distance(previous, position) <= tolerance:
+            continue
+        if merged:
+            before = merged[-2] if len(merged) > 1 else tuple(start)
+            if is_collinear(before, merged[-1], position):
+                merged[-1] = position
+                previous = position
+                continue
+        merged.append(position)
+        previous = position
+    return merged
+
+
+def distance(a, b):
+    return math.sqrt(sum([(p - q) ** 2 for p, q in zip(a, b)]))
+
+
+def is_collinear(a, b, c, tolerance=1e-6):
+    """Check if b lies on the segment from a to c (tolerance is the sine of the allowed bend)."""
+    ab = [q - p for p, q in zip(a, b)]
+    bc = [q - p for p, q in zip(b, c)]
+    cross = [ab[1] * bc[2] - ab[2] * bc[1], ab[2] * bc[0] - ab[0] * bc[2], ab[0] * bc[1] - ab[1] * bc[0]]
+    dot = sum([p * q for p, q in zip(ab, bc)])
+    cross_length = math.sqrt(sum([v * v for v in cross]))
+    return dot > 0 and cross_length <= tolerance * distance(a, b) * distance(b, c)
+
+
+def interpolate(a, b, fraction):
+    return tuple([p + fraction * (q - p) for p, q in zip(a, b)])
+
+
+def axis_move_time(distance, velocity, acceleration):
+    """Time for one axis to travel distance with a trapezoidal (or triangular) velocity profile."""
+    distance = abs(distance)
+    if distance * acceleration < velocity ** 2: # never reaches full speed
+        return 2.0 * math.sqrt(distance / acceleration)
+    return distance / velocity + velocity / acceleration
+
+
+def move_time(start, end, fast=True, kinematics=DEFAULT_KINEMATICS):
+    """Return the time of a straight move: all axes travel together, so the slowest one sets the pace."""
+    scale = 1.0 if fast else kinematics.slow_fraction
+    return max([axis_move_time(e - s, v * scale, a)
+                for s, e, v, a in zip(start, end, kinematics.max_velocity, kinematics.acceleration)]) \
+        + kinematics.settle_time
+
+
+def plan_trajectory(start, waypoints, kinematics=DEFAULT_KINEMATICS, max_segment=None):
+    """Return the list of Steps that takes the CNC from start through all waypoints.
+
+    The final kinematics.slow_distance units before the last waypoint are approached
+    at slow speed. If max_segment is given, no single step is longer than max_segment
+    units.
+    """
+    slow_distance = kinematics.slow_distance
+    positions = merge_collinear(start, resolve_waypoints(start, waypoints))
+    steps = []
+    current = tuple(start)
+    for index, position in enumerate(positions):
+        pieces = []
+        length = distance(current, position)
+        if index == len(positions) - 1 and length > slow_distance:
+            pieces.append((interpolate(current, position, 1.0 - slow_distance / length), True))
+            pieces.append((position, False))
+        else:
+            pieces.append((position, index < len(positions) - 1))
+
+        for [target, fast] in pieces:
+            piece_length = distance(current, target)
+            num_splits = 1
+            if max_segment is not None and piece_length > max_segment:
+                num_splits = int(math.ceil(piece_length / max_segment))
+            split_start = current
+            for split in range(1, num_splits + 1):
+                split_target = interpolate(current, target, float(split) / num_splits) if split < num_splits else target
+                steps.append(Step(split_target, fast, piece_length / num_splits,
+                                  move_time(split_start, split_target, fast, kinematics)))
+                split_start = split_target
+            current = target
+    return steps
+
+
+def plan_duration(plan):
+    """Return the total time taken by a plan in seconds."""
+    return sum([step.duration for step in plan])
@@ -2,7 +2,10 @@
 # ----------------------------------------------------------------------------------------
 # A wrapper class for the Hamilton MVP valve chain and the Widgets that display
 # their status.  All interactions with the valve chain should go through this
-# class.
+# class. Several daisy chains on separate serial ports can be combined into one
+# global valve index space: valves are numbered in chain order and each chain is
+# served by its own poller thread so that moves on different buses run in parallel.
+# The USB CNC is driven from a worker thread as well.
 # ----------------------------------------------------------------------------------------
 # Jeff Moffitt
 # 12/28/13
@@ -12,10 +15,15 @@
 # ----------------------------------------------------------------------------------------
 # Import
 # ----------------------------------------------------------------------------------------
+import math
+import os
 import sys
 from PyQt4 import QtCore, QtGui
 from qtValveControl import QtValveControl
 from hamilton import HamiltonMVP
+from valvePoller import ValvePoller
+from moveTimeModel import MoveTimeModel, cncKey, valveKey
+from cncWorker import CNCWorker
 
 from cnc_talk import CNC, MockCNC
 
@@ -23,11 +31,21 @@ from cnc_talk import CNC, MockCNC
 # ValveChain Class Definition
 # ----------------------------------------------------------------------------------------
 class ValveChain(QtGui.QWidget):
+
+    # Define custom signals
+    cnc_move_done_signal = QtCore.pyqtSignal() # all requested CNC moves have finished
+
     def __init__(self,
                  parent = None,
                  com_port = 2,
                  num_simulated_valves = 0,
                  usb_cnc = False,
+                 topology_file = None,
+                 move_model_file = None,
+                 well_cache_file = None,
+                 direction_overrides = {},
+                 poll_time = 2000,
+                 fast_poll_time = 100,
                  verbose = False
                  ):
 
@@ -37,41 +55,98 @@ class ValveChain(QtGui.QWidget):
         # Define local attributes
         self.com_port = com_port
         self.verbose = verbose
-        self.poll_time = 2000
+        self.poll_time = poll_time              # idle valve status poll interval (ms)
+        self.fast_poll_time = fast_poll_time    # poll interval while valves move (ms)
+        self.simulate_cnc = (usb_cnc == "simulated")
+
+        # Create the model of measured valve and CNC move times
+        self.move_model = MoveTimeModel(model_file = move_model_file,
+                                        verbose = self.verbose)
 
-        # Create instance of Hamilton class
+        # Create an instance of the Hamilton class for each serial port
+        self.valve_chains = []
         if num_simulated_valves > 0:
             print 'simulating valves'
-            self.valve_chain = HamiltonMVP(com_port = 0,
-                                           num_simulated_valves = num_simulated_valves,
-                                           verbose = self.verbose)
+            self.valve_chains.append(HamiltonMVP(com_port = 0,
+                                                 num_simulated_valves = num_simulated_valves,
+                                                 verbose = self.verbose))
         else:
-            self.valve_chain = HamiltonMVP(com_port = self.com_port,
-                                           verbose = self.verbose)
+            if isinstance(self.com_port, tuple) or isinstance(self.com_port, list):
+                com_ports = list(self.com_port)
+            else:
+                com_ports = [self.com_port]
+            for [chain_ID, chain_com_port] in enumerate(com_ports):
+                chain_topology_file = topology_file
+                if (topology_file is not None) and (len(com_ports) > 1):
+                    [root, extension] = os.path.splitext(topology_file)
+                    chain_topology_file = root + "_" + str(chain_ID + 1) + extension
+                self.valve_chains.append(HamiltonMVP(com_port = chain_com_port,
+                                                     topology_file = chain_topology_file,
+                                                     verbose = self.verbose))
+
+        # Map global valve IDs to (chain ID, valve ID within the chain)
+        self.valve_map = []
+        for [chain_ID, valve_chain] in enumerate(self.valve_chains):
+            for local_valve_ID in range(valve_chain.howManyValves()):
+                self.valve_map.append((chain_ID, local_valve_ID))
+
+        # Hand the per-valve rotation overrides to the chain that owns each valve
+        for [valve_ID, direction] in direction_overrides.items():
+            if valve_ID < len(self.valve_map):
+                [chain_ID, local_valve_ID] = self.valve_map[valve_ID]
+                self.valve_chains[chain_ID].direction_overrides[local_valve_ID] = direction
 
         if usb_cnc:
             if isinstance(usb_cnc, tuple) or isinstance(usb_cnc, list):
-                self.cnc = CNC(usb_cnc[0], usb_cnc[1])
+                self.cnc = CNC(usb_cnc[0], usb_cnc[1], well_cache_file = well_cache_file)
             elif usb_cnc == "simulated":
-                self.cnc = MockCNC()
+                self.cnc = MockCNC(well_cache_file = well_cache_file)
             else:
-                self.cnc = CNC()
+                self.cnc = CNC(well_cache_file = well_cache_file)
         else:
             self.cnc = None
+        self.cnc_moves_pending = 0
 
         # Create QtValveControl widgets for each valve in the chain
-        self.num_valves = self.valve_chain.howManyValves()
+        self.num_valves = len(self.valve_map)
         self.valve_names = []
         self.valve_widgets = []
         
+        # Create a status poller per chain: from here on it owns all traffic to its chain
+        self.valve_pollers = []
+        valve_offset = 0
+        for valve_chain in self.valve_chains:
+            valve_poller = ValvePoller(valve_chain = valve_chain,
+                                       move_model = self.move_model,
+                                       valve_offset = valve_offset,
+                                       poll_time = self.poll_time,
+                                       fast_poll_time = self.fast_poll_time,
+                                       verbose = self.verbose)
+            valve_poller.pollStatus() # Initial status, read before the poller thread starts
+            self.valve_pollers.append(valve_poller)
+            valve_offset += valve_chain.howManyValves()
+
         # Create GUI
         self.createGUI() # Widgets created here
 
-        # Define timer for periodic polling of valve status
-        self.valve_poll_timer = QtCore.QTimer()        
-        self.valve_poll_timer.setInterval(self.poll_time)
-        self.valve_poll_timer.timeout.connect(self.pollValveStatus)
-        self.valve_poll_timer.start()
+        # Run each poller in its own thread and connect signals
+        self.poller_threads = []
+        for valve_poller in self.valve_pollers:
+            poller_thread = QtCore.QThread()
+            valve_poller.moveToThread(poller_thread)
+            poller_thread.started.connect(valve_poller.startPolling)
+            valve_poller.status_signal.connect(self.updateValveStatus)
+            poller_thread.start()
+            self.poller_threads.append(poller_thread)
+
+        # Run the CNC in its own thread: from here on the worker owns all CNC traffic
+        if self.cnc is not None:
+            self.cnc_worker = CNCWorker(cnc = self.cnc,
+                                        verbose = self.verbose)
+            self.cnc_thread = QtCore.QThread()
+            self.cnc_worker.moveToThread(self.cnc_thread)
+            self.cnc_worker.move_done_signal.connect(self.handleCNCMoveDone)
+            self.cnc_thread.start()
 
     # ------------------------------------------------------------------------------------
     # Change specified valve position
@@ -99,11 +174,12 @@ class ValveChain(QtGui.QWidget):
                 port_ID = self.valve_widgets[valve_ID].getPortIndex()
             rotation_direction = self.valve_widgets[valve_ID].getDesiredRotationIndex()
 
-            self.valve_chain.changePort(valve_ID = valve_ID,
-                                    port_ID = port_ID,
-                                    direction = rotation_direction)
+            [chain_ID, local_valve_ID] = self.valve_map[valve_ID]
+            self.valve_pollers[chain_ID].move_port_signal.emit(local_valve_ID, port_ID, rotation_direction)
         else:
-            self.cnc.move(port_ID, direction = rotation_direction)
+            self.cnc_moves_pending += 1
+            self.valve_widgets[-1].setStatus(("Moving", True))
+            self.cnc_worker.move_signal.emit(port_ID, rotation_direction)
 
         # Update valve display
         self.pollValveStatus()
@@ -113,9 +189,17 @@ class ValveChain(QtGui.QWidget):
     # ------------------------------------------------------------------------------------
     def close(self):
         if self.verbose: print "Closing valve chain"
-        self.valve_chain.close()
+        for poller_thread in self.poller_threads:
+            poller_thread.quit()
+            poller_thread.wait()
+        if self.verbose: self.printLatencyReport()
+        self.move_model.save()
+        for valve_chain in self.valve_chains:
+            valve_chain.close()
         if self.cnc is not None:
             print "Closing USB CNC"
+            self.cnc_thread.quit()
+            self.cnc_thread.wait()
             self.cnc.close()
 
     # ------------------------------------------------------------------------------------
@@ -127,15 +211,20 @@ class ValveChain(QtGui.QWidget):
         self.valveChainGroupBox.setTitle("Valve Controls")
         self.valveChainGroupBoxLayout = QtGui.QVBoxLayout(self.valveChainGroupBox)
 
+        snapshot = self.getValveStatus()
         for valve_ID in range(self.num_valves):
+            [chain_ID, local_valve_ID] = self.valve_map[valve_ID]
+            valve_chain = self.valve_chains[chain_ID]
             valve_widget = QtValveControl(self,
                                          ID = valve_ID)
             self.valve_names.append(str(valve_ID + 1)) # Save valve name
             valve_widget.setValveName("Valve " + str(valve_ID+1)) # Valve names are +1 valve IDs
-            valve_widget.setValveConfiguration(self.valve_chain.howIsValveConfigured(valve_ID))
-            valve_widget.setPortNames(self.valve_chain.getDefaultPortNames(valve_ID))
-            valve_widget.setRotationDirections(self.valve_chain.getRotationDirections(valve_ID))
-            valve_widget.setStatus(self.valve_chain.getStatus(valve_ID))
+            valve_widget.setValveConfiguration(valve_chain.whatIsValveConfiguration(local_valve_ID))
+            valve_widget.setPortNames(valve_chain.getDefaultPortNames(local_valve_ID))
+            valve_widget.setRotationDirections(valve_chain.getRotationDirections(local_valve_ID))
+            valve_widget.setCurrentDesiredRotation(valve_chain.direction_overrides.get(local_valve_ID,
+                                                                                    valve_chain.shortest_path))
+            valve_widget.setStatus(snapshot[valve_ID].toDisplay())
 
             valve_widget.change_port_signal.connect(self.changeValvePosition)
 
@@ -167,40 +256,189 @@ class ValveChain(QtGui.QWidget):
         self.valve_reset_action = QtGui.QAction("Valve Chain Reset", self)
         self.valve_reset_action.triggered.connect(self.reinitializeChain)
 
+        self.valve_latency_action = QtGui.QAction("Valve Latency Report", self)
+        self.valve_latency_action.triggered.connect(self.printLatencyReport)
+
         self.menu_names = ["Valve"]
-        self.menu_items = [[self.valve_reset_action]]
+        self.menu_items = [[self.valve_reset_action,
+                            self.valve_latency_action]]
+
+    # ------------------------------------------------------------------------------------
+    # Estimate the wall time of a protocol from the measured move time model.
+    #   steps is a list of [command_type, command_data, duration]
+    #   Returns (estimated time, lower bound, upper bound) in seconds; the bounds are
+    #   a +/- 2 standard deviation band.
+    # ------------------------------------------------------------------------------------
+    def estimateProtocolTime(self, steps):
+        # Start from the cached valve ports and the current CNC position
+        ports = [0] * self.num_valves
+        for valve_ID, status in enumerate(self.getValveStatus()[:self.num_valves]):
+            if status.port is not None:
+                ports[valve_ID] = status.port
+        if self.cnc is not None:
+            cnc_position = list(self.cnc_worker.getPosition())
+
+        total_time = 0.0
+        total_variance = 0.0
+        for [command_type, command_data, duration] in steps:
+            total_time += duration
+            if not command_type == "valve":
+                continue
+
+            # Valves in a move set rotate in parallel: the slowest one sets the pace
+            valve_time = 0.0
+            valve_variance = 0.0
+            for valve_ID, port_ID in enumerate(command_data):
+                if valve_ID < self.num_valves:
+                    if port_ID >= 0 and not (port_ID == ports[valve_ID]): # redundant moves are skipped
+                        [chain_ID, local_valve_ID] = self.valve_map[valve_ID]
+                        valve_chain = self.valve_chains[chain_ID]
+                        direction = valve_chain.resolveDirection(local_valve_ID,
+                                                                 port_ID,
+                                                                 self.valve_widgets[valve_ID].getDesiredRotationIndex(),
+                                                                 from_port_ID = ports[valve_ID])
+                        distance = valve_chain.portDistance(local_valve_ID, ports[valve_ID], port_ID, direction)
+                        [mean, variance] = self.move_model.estimate(valveKey(valve_ID, direction), distance)
+                        if mean > valve_time:
+                            [valve_time, valve_variance] = [mean, variance]
+                        ports[valve_ID] = port_ID
+                elif (self.cnc is not None) and (not port_ID == -1):
+                    # CNC moves block the protocol until they complete
+                    direction = self.valve_widgets[-1].getDesiredRotationIndex()
+                    [planned_time, cnc_position] = self.cnc.plan_time(cnc_position, port_ID, direction)
+                    [mean, variance] = self.move_model.estimate(cncKey(), planned_time)
+                    total_time += mean
+                    total_variance += variance
+
+            # Valve moves run alongside the command duration and only delay the
+            # protocol if they outlast it
+            if valve_time > duration:
+                total_time += valve_time - duration
+                total_variance += valve_variance
+
+        band = 2.0 * math.sqrt(total_variance)
+        return (total_time, max(total_time - band, 0.0), total_time + band)
+
+    # ------------------------------------------------------------------------------------
+    # Estimate the time (s) the CNC needs to travel between two targets, e.g. two
+    # cnc_pos entries (plate_ID, port_ID): raises ValueError for unknown targets
+    # ------------------------------------------------------------------------------------
+    def estimateCNCTravelTime(self, from_target, to_target):
+        direction = self.valve_widgets[-1].getDesiredRotationIndex()
+        try:
+            [from_plate, x, y] = self.cnc.find_target(from_target, direction)
+            from_position = from_plate.find_position(x, y)
+            [planned_time, end_position] = self.cnc.plan_time(from_position, to_target, direction)
+        except (IndexError, KeyError):
+            raise ValueError("Unknown CNC target: " + str(from_target) + " or " + str(to_target))
+        return self.move_model.estimate(cncKey(), planned_time)[0]
+
+    # ------------------------------------------------------------------------------------
+    # Return (number of redundant valve moves skipped, serial round trips saved) since
+    # the last call to resetMoveSavings
+    # ------------------------------------------------------------------------------------
+    def getMoveSavings(self):
+        skipped_moves = 0
+        saved_round_trips = 0
+        for valve_poller in self.valve_pollers:
+            [chain_skipped_moves, chain_saved_round_trips] = valve_poller.getMoveSavings()
+            skipped_moves += chain_skipped_moves
+            saved_round_trips += chain_saved_round_trips
+        return (skipped_moves, saved_round_trips)
+
+    # ------------------------------------------------------------------------------------
+    # Return the cached status of all valves (or of a single valve): never touches
+    # the serial port
+    # ------------------------------------------------------------------------------------
+    def getValveStatus(self, valve_ID = None):
+        snapshot = ()
+        for valve_poller in self.valve_pollers: # chains are numbered in order
+            snapshot += valve_poller.getSnapshot()
+        if valve_ID is None:
+            return snapshot
+        elif valve_ID >= 0 and valve_ID < len(snapshot):
+            return snapshot[valve_ID]
+        else:
+            return None
+
+    # ------------------------------------------------------------------------------------
+    # Handle a finished CNC move reported by the CNC worker
+    # ------------------------------------------------------------------------------------
+    def handleCNCMoveDone(self, result):
+        self.cnc_moves_pending = max(self.cnc_moves_pending - 1, 0)
+        if result["completed"] and not self.simulate_cnc:
+            [planned_time, end_position] = self.cnc.plan_time(result["start_position"],
+                                                               result["port"],
+                                                               result["direction"])
+            self.move_model.addSample(cncKey(), planned_time, result["time"])
+        self.pollValveStatus()
+        if self.cnc_moves_pending == 0:
+            self.cnc_move_done_signal.emit()
 
     # ------------------------------------------------------------------------------------
     # Determine number of valves
     # ------------------------------------------------------------------------------------
     def howManyValves(self):
-        return self.valve_chain.howManyValves + (self.cnc is not None)
+        return self.num_valves + (self.cnc is not None)
 
     # ------------------------------------------------------------------------------------
-    # Update valve status display with the current status each valve in the chain
+    # Check if requested CNC moves are still in progress
+    # ------------------------------------------------------------------------------------
+    def isCNCMoving(self):
+        return self.cnc_moves_pending > 0
+
+    # ------------------------------------------------------------------------------------
+    # Update valve status display from the most recent status snapshot
     # ------------------------------------------------------------------------------------
     def pollValveStatus(self):
-        for valve_ID in range(self.num_valves):
-            self.valve_widgets[valve_ID].setStatus(self.valve_chain.getStatus(valve_ID))
-        if self.cnc is not None:
-            self.valve_widgets[-1].setStatus(self.cnc.get_status())
+        self.updateValveStatus()
+
+    # ------------------------------------------------------------------------------------
+    # Display the measured round trip times of valve commands
+    # ------------------------------------------------------------------------------------
+    def printLatencyReport(self):
+        for valve_chain in self.valve_chains:
+            print "Hamilton MVP command latencies (port " + str(valve_chain.com_port) + "):"
+            print valve_chain.getLatencyReport()
 
     # ------------------------------------------------------------------------------------
     # Change port status based on external command
     # ------------------------------------------------------------------------------------          
     def receiveCommand(self, command):
+        # Collect all valve moves into a single move set per chain
+        moves = [[] for valve_chain in self.valve_chains]
         for valve_ID, port_ID in enumerate(command):
-            if port_ID >= 0: # -1 is a flag for 'do not change port'
+            if valve_ID < self.num_valves:
+                if port_ID >= 0: # -1 is a flag for 'do not change port'
+                    rotation_direction = self.valve_widgets[valve_ID].getDesiredRotationIndex()
+                    [chain_ID, local_valve_ID] = self.valve_map[valve_ID]
+                    moves[chain_ID].append((local_valve_ID, port_ID, rotation_direction))
+            elif port_ID >= 0:
                 self.changeValvePosition(valve_ID, port_ID)
 
+        # Each chain executes its move set in its own thread
+        for [chain_ID, chain_moves] in enumerate(moves):
+            if len(chain_moves) > 0:
+                if self.verbose:
+                    print "Changing valves on port " + str(self.valve_chains[chain_ID].com_port) + ": " + str(chain_moves)
+                self.valve_pollers[chain_ID].move_set_signal.emit(chain_moves)
+
     # ------------------------------------------------------------------------------------
     # Reinitialize the valve chain
     # ------------------------------------------------------------------------------------          
     def reinitializeChain(self):
-        self.valve_chain.resetChain()
+        for valve_poller in self.valve_pollers:
+            valve_poller.reset_chain_signal.emit()
         #if self.cnc is not None:
         #    self.cnc.reset()
 
+    # ------------------------------------------------------------------------------------
+    # Reset the count of redundant valve moves skipped
+    # ------------------------------------------------------------------------------------
+    def resetMoveSavings(self):
+        for valve_poller in self.valve_pollers:
+            valve_poller.resetMoveSavings()
+
     # ------------------------------------------------------------------------------------
     # Set enabled status for display items
     # ------------------------------------------------------------------------------------          
@@ -210,6 +448,15 @@ class ValveChain(QtGui.QWidget):
         if self.cnc is not None:
             self.valve_widgets[-1].setEnabled(is_enabled)
     
+    # ------------------------------------------------------------------------------------
+    # Update valve status display when any poller publishes a new status snapshot
+    # ------------------------------------------------------------------------------------
+    def updateValveStatus(self, chain_snapshot = None):
+        for valve_ID, status in enumerate(self.getValveStatus()[:self.num_valves]):
+            self.valve_widgets[valve_ID].setStatus(status.toDisplay())
+        if (self.cnc is not None) and not self.isCNCMoving():
+            self.valve_widgets[-1].setStatus(self.cnc.get_status())
+
 # ----------------------------------------------------------------------------------------
 # Stand Alone Test Class
 # ----------------------------------------------------------------------------------------
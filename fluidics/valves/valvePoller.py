@@ -0,0 +1,318 @@
+#!/usr/bin/python
+# ----------------------------------------------------------------------------------------
+# A worker class that owns the serial traffic to a Hamilton MVP valve chain. It
+# runs in its own QThread, polls the status of every valve (quickly while a valve
+# is moving or was just commanded, decaying to a slow idle rate), and
+# publishes an immutable snapshot of that status through a Qt signal so that the
+# GUI (and anything else) can read valve status without blocking on the serial
+# port. Valve moves and chain resets are also executed in this thread, which lets
+# the poller drop protocol moves to ports its last verified snapshot already shows.
+# ----------------------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------------------
+# Import
+# ----------------------------------------------------------------------------------------
+import collections
+import threading
+import time
+from PyQt4 import QtCore
+from moveTimeModel import valveKey
+
+# ----------------------------------------------------------------------------------------
+# ValveStatus: immutable status record for a single valve
+#   port        current port index (0 = Port 1) or None if unknown
+#   moving      True if the valve reports that it has not finished moving
+#   overloaded  True if the valve reports an overload
+#   timestamp   time.time() at which the status was read
+# ----------------------------------------------------------------------------------------
+class ValveStatus(collections.namedtuple("ValveStatus", ["port", "moving", "overloaded", "timestamp"])):
+    __slots__ = ()
+
+    # ------------------------------------------------------------------------------------
+    # Convert to the (text, is_moving) tuple used by QtValveControl.setStatus
+    # ------------------------------------------------------------------------------------
+    def toDisplay(self):
+        if self.port is None:
+            text = "Unknown Port"
+        else:
+            text = "Port " + str(self.port + 1)
+        if self.overloaded:
+            text += " (Overloaded)"
+        return (text, self.moving)
+
+# ----------------------------------------------------------------------------------------
+# Convert the port string returned by HamiltonMVP.whereIsValve to a port index
+# ----------------------------------------------------------------------------------------
+def portStringToIndex(port_string):
+    try:
+        return int(port_string.split()[-1]) - 1
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+# ----------------------------------------------------------------------------------------
+# ValvePoller Class Definition
+# ----------------------------------------------------------------------------------------
+class ValvePoller(QtCore.QObject):
+
+    # Define custom signals
+    status_signal = QtCore.pyqtSignal(object) # Tuple of ValveStatus, one per valve
+
+    # Define request signals: emitted from the GUI thread, handled in the poller thread
+    move_port_signal = QtCore.pyqtSignal(int, int, int) # valve_ID, port_ID, direction
+    move_set_signal = QtCore.pyqtSignal(object) # list of (valve_ID, port_ID, direction)
+    reset_chain_signal = QtCore.pyqtSignal()
+
+    # Serial round trips of a move (command + first completion query) and of the
+    # status read of one valve (port, movement and overload queries)
+    move_queries = 2
+    status_queries = 3
+
+    def __init__(self,
+                 valve_chain = None,
+                 move_model = None,
+                 valve_offset = 0,
+                 poll_time = 2000,
+                 fast_poll_time = 100,
+                 poll_decay = 2.0,
+                 verbose = False):
+
+        # Initialize parent class
+        QtCore.QObject.__init__(self)
+
+        # Define local attributes
+        self.valve_chain = valve_chain
+        self.move_model = move_model
+        self.valve_offset = valve_offset # index of the first valve of this chain in the move model
+        self.poll_time = poll_time              # idle poll interval (ms)
+        self.fast_poll_time = fast_poll_time    # poll interval while valves move (ms)
+        self.poll_decay = poll_decay            # growth factor of the interval once idle
+        self.poll_interval = poll_time
+        self.verbose = verbose
+        self.poll_timer = None
+        self.polling = False
+        self.snapshot = ()
+
+        # Redundant move accounting (moves dropped because the valve is already there):
+        # each dropped move saves at least its move command and one completion query,
+        # and a move set that is dropped entirely also saves the status poll after it
+        self.skip_redundant_moves = True
+        self.savings_lock = threading.Lock()
+        self.skipped_moves = 0
+        self.skipped_round_trips = 0
+
+        # Connect request signals: queued once the poller has been moved to its thread
+        self.move_port_signal.connect(self.changePort)
+        self.move_set_signal.connect(self.changePorts)
+        self.reset_chain_signal.connect(self.resetChain)
+
+    # ------------------------------------------------------------------------------------
+    # Change the port of a valve (executed in the poller thread)
+    # ------------------------------------------------------------------------------------
+    @QtCore.pyqtSlot(int, int, int)
+    def changePort(self, valve_ID, port_ID, direction):
+        self.poll_interval = self.fast_poll_time
+        direction = self.valve_chain.resolveDirection(valve_ID, port_ID, direction)
+        self.executeMoves([(valve_ID, port_ID, direction)])
+
+    # ------------------------------------------------------------------------------------
+    # Change the port of several valves at once (executed in the poller thread):
+    # moves to the port a valve is verified to be at are dropped, the rest are issued
+    # in one burst, then a single combined wait and status poll
+    # ------------------------------------------------------------------------------------
+    @QtCore.pyqtSlot(object)
+    def changePorts(self, moves):
+        self.poll_interval = self.fast_poll_time
+        moves = [(valve_ID, port_ID, self.valve_chain.resolveDirection(valve_ID, port_ID, direction))
+                 for [valve_ID, port_ID, direction] in moves]
+        if self.skip_redundant_moves:
+            moves = self.dropRedundantMoves(moves)
+            if len(moves) == 0:
+                with self.savings_lock:
+                    self.skipped_round_trips += self.status_queries * self.valve_chain.howManyValves()
+                return
+        self.executeMoves(moves)
+
+    # ------------------------------------------------------------------------------------
+    # Remove moves whose target port matches the verified snapshot and account for the
+    # serial round trips they would have taken
+    # ------------------------------------------------------------------------------------
+    def dropRedundantMoves(self, moves):
+        required_moves = []
+        for [valve_ID, port_ID, direction] in moves:
+            if self.isVerifiedAtPort(valve_ID, port_ID):
+                with self.savings_lock:
+                    self.skipped_moves += 1
+                    self.skipped_round_trips += self.move_queries
+                if self.verbose:
+                    print "Valve " + str(valve_ID + 1) + " is already at port " + str(port_ID + 1) + ": skipping move"
+            else:
+                required_moves.append((valve_ID, port_ID, direction))
+        return required_moves
+
+    # ------------------------------------------------------------------------------------
+    # Issue moves in one burst, publish a snapshot showing the acknowledged valves as
+    # moving, wait for them to finish and publish their final status
+    # ------------------------------------------------------------------------------------
+    def executeMoves(self, moves):
+        previous_ports = list(self.valve_chain.current_port)
+        start_time = time.time()
+        moved_valves = self.valve_chain.changePorts(moves, wait_until_done = False)
+        self.publishMovingSnapshot(moved_valves)
+        if (len(moved_valves) > 0) and not self.valve_chain.simulate:
+            self.valve_chain.waitUntilNotMoving(moved_valves, start_time = start_time)
+        self.recordMoveTimes(moves, previous_ports)
+        self.pollStatus()
+
+    # ------------------------------------------------------------------------------------
+    # Return (number of skipped moves, serial round trips saved) since the last reset
+    # ------------------------------------------------------------------------------------
+    def getMoveSavings(self):
+        with self.savings_lock:
+            return (self.skipped_moves, self.skipped_round_trips)
+
+    # ------------------------------------------------------------------------------------
+    # Return the most recent status snapshot: safe to call from any thread
+    # ------------------------------------------------------------------------------------
+    def getSnapshot(self):
+        return self.snapshot
+
+    # ------------------------------------------------------------------------------------
+    # Check if the last snapshot verifies that a valve is resting at a port. Moves and
+    # polls are serialised in the poller thread and every move is followed by a poll,
+    # so the snapshot is never older than the last move.
+    # ------------------------------------------------------------------------------------
+    def isVerifiedAtPort(self, valve_ID, port_ID):
+        snapshot = self.snapshot
+        if not (0 <= valve_ID < len(snapshot)):
+            return False
+        status = snapshot[valve_ID]
+        return (status.port == port_ID) and (not status.moving) and (not status.overloaded)
+
+    # ------------------------------------------------------------------------------------
+    # Publish a snapshot (without serial traffic) in which the valves whose moves were
+    # just acknowledged are shown moving to their target port
+    # ------------------------------------------------------------------------------------
+    def publishMovingSnapshot(self, moving_valves):
+        if len(moving_valves) == 0:
+            return
+        now = time.time()
+        snapshot = list(self.snapshot)
+        for valve_ID in range(len(snapshot), self.valve_chain.howManyValves()):
+            snapshot.append(ValveStatus(None, False, False, now))
+        for valve_ID in moving_valves:
+            if valve_ID < len(snapshot):
+                snapshot[valve_ID] = ValveStatus(self.valve_chain.current_port[valve_ID], True, False, now)
+        self.snapshot = tuple(snapshot)
+        self.status_signal.emit(self.snapshot)
+
+    # ------------------------------------------------------------------------------------
+    # Read the status of a single valve
+    # ------------------------------------------------------------------------------------
+    def readValveStatus(self, valve_ID):
+        port = portStringToIndex(self.valve_chain.whereIsValve(valve_ID))
+        moving = not (self.valve_chain.isMovementFinished(valve_ID) == True)
+        overloaded = (self.valve_chain.isValveOverloaded(valve_ID) == True)
+        return ValveStatus(port, moving, overloaded, time.time())
+
+    # ------------------------------------------------------------------------------------
+    # Poll all valves, publish a new snapshot and schedule the next poll
+    # ------------------------------------------------------------------------------------
+    @QtCore.pyqtSlot()
+    def pollStatus(self):
+        snapshot = []
+        for valve_ID in range(self.valve_chain.howManyValves()):
+            snapshot.append(self.readValveStatus(valve_ID))
+
+        # Replacing the reference is atomic, so readers never see a partial snapshot
+        self.snapshot = tuple(snapshot)
+        self.status_signal.emit(self.snapshot)
+
+        # Poll quickly while anything moves, then back off towards the idle rate
+        if any([status.moving for status in self.snapshot]):
+            self.poll_interval = self.fast_poll_time
+        else:
+            self.poll_interval = min(int(self.poll_interval * self.poll_decay), self.poll_time)
+        if self.polling:
+            self.poll_timer.start(self.poll_interval)
+
+    # ------------------------------------------------------------------------------------
+    # Add the move times measured by the valve chain to the move time model
+    # ------------------------------------------------------------------------------------
+    def recordMoveTimes(self, moves, previous_ports):
+        if self.move_model is None:
+            return
+        move_times = self.valve_chain.last_move_times
+        for [valve_ID, port_ID, direction] in moves:
+            if (valve_ID in move_times) and (valve_ID < len(previous_ports)):
+                distance = self.valve_chain.portDistance(valve_ID,
+                                                         previous_ports[valve_ID],
+                                                         port_ID,
+                                                         direction)
+                self.move_model.addSample(valveKey(self.valve_offset + valve_ID, direction),
+                                          distance,
+                                          move_times[valve_ID])
+
+    # ------------------------------------------------------------------------------------
+    # Reset the redundant move accounting
+    # ------------------------------------------------------------------------------------
+    def resetMoveSavings(self):
+        with self.savings_lock:
+            self.skipped_moves = 0
+            self.skipped_round_trips = 0
+
+    # ------------------------------------------------------------------------------------
+    # Readdress and redetect the valve chain (executed in the poller thread)
+    # ------------------------------------------------------------------------------------
+    @QtCore.pyqtSlot()
+    def resetChain(self):
+        self.poll_interval = self.fast_poll_time
+        self.valve_chain.resetChain()
+        self.pollStatus()
+
+    # ------------------------------------------------------------------------------------
+    # Start polling: connected to QThread.started so that the timer lives in the poller
+    # thread. The timer is single shot and rescheduled by every poll.
+    # ------------------------------------------------------------------------------------
+    @QtCore.pyqtSlot()
+    def startPolling(self):
+        if self.poll_timer is None:
+            self.poll_timer = QtCore.QTimer()
+            self.poll_timer.setSingleShot(True)
+            self.poll_timer.timeout.connect(self.pollStatus)
+        self.polling = True
+        self.poll_timer.start(self.poll_interval)
+        if self.verbose: print "Started valve status polling"
+
+    # ------------------------------------------------------------------------------------
+    # Stop the periodic poll
+    # ------------------------------------------------------------------------------------
+    @QtCore.pyqtSlot()
+    def stopPolling(self):
+        self.polling = False
+        if self.poll_timer is not None:
+            self.poll_timer.stop()
+        if self.verbose: print "Stopped valve status polling"
+
+#
+# The MIT License
+#
+# Copyright (c) 2013 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
@@ -0,0 +1,81 @@
+"""
+Plan the order in which a set of CNC targets is visited.
+
+Given targets whose relative order is free and a function returning the travel
+time between two targets, build a short open route with a nearest neighbour
+pass followed by 2-opt improvement. Travel times are looked up once per pair,
+so the cost function can be as expensive as a path length calculation over the
+plate well tables.
+"""
+
+
+def route_time(order, times, start=None):
+    """Return the travel time of visiting the targets in order (optionally from a start index)."""
+    total = 0.0
+    previous = start
+    for index in order:
+        if previous is not None:
+            total += times[previous][index]
+        previous = index
+    return total
+
+
+def nearest_neighbour(times, first, indices):
+    """Return a route through indices that always moves on to the closest unvisited target."""
+    order = [first]
+    remaining = set(indices) - set([first])
+    while remaining:
+        closest = min(remaining, key=lambda index: times[order[-1]][index])
+        order.append(closest)
+        remaining.remove(closest)
+    return order
+
+
+def two_opt(order, times, start=None, max_passes=20):
+    """Improve a route by reversing segments for as long as that shortens it."""
+    order = list(order)
+    best_time = route_time(order, times, start)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(len(order) - 1):
+            for j in range(i + 1, len(order)):
+                candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                candidate_time = route_time(candidate, times, start)
+                if candidate_time < best_time - 1e-9:
+                    order, best_time = candidate, candidate_time
+                    improved = True
+        if not improved:
+            break
+    return order
+
+
+def plan_visit_order(targets, travel_time, start=None):
+    """Reorder targets to minimise the total travel time.
+
+    targets is a list of targets, travel_time(a, b) returns the seconds needed to
+    move from target a to target b, and start (if given) is where the CNC is
+    before the first visit. Returns (order, original time, planned time) where
+    order is a list of indices into targets.
+    """
+    points = list(targets) + ([start] if start is not None else [])
+    times = [[0.0 if i == j else travel_time(a, b) for j, b in enumerate(points)] for i, a in enumerate(points)]
+    indices = range(len(targets))
+    start_index = len(targets) if start is not None else None
+
+    original_time = route_time(indices, times, start_index)
+    best_order = list(indices)
+    best_time = original_time
+    if len(targets) < 2 or (len(targets) < 3 and start is None):
+        return best_order, original_time, best_time
+
+    # Without a fixed start, seed from the best nearest neighbour route over all first visits
+    if start is None:
+        seeds = [nearest_neighbour(times, first, indices) for first in indices]
+    else:
+        seeds = [nearest_neighbour(times, min(indices, key=lambda index: times[start_index][index]), indices)]
+    seed = min(seeds, key=lambda order: route_time(order, times, start_index))
+    order = two_opt(seed, times, start_index)
+    order_time = route_time(order, times, start_index)
+    if order_time < best_time - 1e-9:
+        best_order, best_time = order, order_time
+    return best_order, original_time, best_time
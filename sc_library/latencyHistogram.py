@@ -0,0 +1,141 @@
+#!/usr/bin/python
+#
+## @file
+#
+# A small, thread safe accumulator of per-operation latencies. Latencies are
+# binned into a fixed set of (roughly logarithmic) bins so that the round trip
+# time of hardware commands can be monitored without storing every sample.
+#
+
+import bisect
+import threading
+
+## LatencyHistogram
+#
+# Per-operation latency histograms.
+#
+class LatencyHistogram(object):
+
+    ## __init__
+    #
+    # @param bin_edges The upper edges of the histogram bins in seconds. Latencies above the last edge are counted in an overflow bin.
+    #
+    def __init__(self, bin_edges = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)):
+        self.bin_edges = tuple(bin_edges)
+        self.lock = threading.Lock()
+        self.reset()
+
+    ## getHistogram
+    #
+    # @param name The operation name.
+    #
+    # @return A list of (upper bin edge in seconds, count) pairs. The upper edge of the overflow bin is None.
+    #
+    def getHistogram(self, name):
+        with self.lock:
+            counts = list(self.histograms.get(name, [0] * (len(self.bin_edges) + 1)))
+        return zip(list(self.bin_edges) + [None], counts)
+
+    ## getNames
+    #
+    # @return A sorted list of the operation names that have been recorded.
+    #
+    def getNames(self):
+        with self.lock:
+            return sorted(self.histograms.keys())
+
+    ## getSummary
+    #
+    # @param name The operation name.
+    #
+    # @return A dictionary with the count, timeouts, mean, min and max latency (in seconds) of the operation.
+    #
+    def getSummary(self, name):
+        with self.lock:
+            if not name in self.totals:
+                return {"count": 0, "timeouts": 0, "mean": 0.0, "min": 0.0, "max": 0.0}
+            [count, timeouts, total, minimum, maximum] = self.totals[name]
+        return {"count": count,
+                "timeouts": timeouts,
+                "mean": total / count,
+                "min": minimum,
+                "max": maximum}
+
+    ## record
+    #
+    # @param name The operation name.
+    # @param seconds The measured latency in seconds.
+    # @param timed_out True if the operation did not complete before its deadline.
+    #
+    def record(self, name, seconds, timed_out = False):
+        bin_index = bisect.bisect_left(self.bin_edges, seconds)
+        with self.lock:
+            if not name in self.histograms:
+                self.histograms[name] = [0] * (len(self.bin_edges) + 1)
+                self.totals[name] = [0, 0, 0.0, seconds, seconds]
+            self.histograms[name][bin_index] += 1
+            totals = self.totals[name]
+            totals[0] += 1
+            if timed_out:
+                totals[1] += 1
+            totals[2] += seconds
+            totals[3] = min(totals[3], seconds)
+            totals[4] = max(totals[4], seconds)
+
+    ## report
+    #
+    # @return A human readable summary of all recorded operations.
+    #
+    def report(self):
+        lines = []
+        for name in self.getNames():
+            summary = self.getSummary(name)
+            line = "%-12s n=%-6d timeouts=%-4d mean=%7.1f ms min=%7.1f ms max=%7.1f ms" % (name,
+                                                                                      summary["count"],
+                                                                                      summary["timeouts"],
+                                                                                      1000.0 * summary["mean"],
+                                                                                      1000.0 * summary["min"],
+                                                                                      1000.0 * summary["max"])
+            lines.append(line)
+            bins = []
+            for [edge, count] in self.getHistogram(name):
+                if count > 0:
+                    if edge is None:
+                        bins.append(">%g ms: %d" % (1000.0 * self.bin_edges[-1], count))
+                    else:
+                        bins.append("<=%g ms: %d" % (1000.0 * edge, count))
+            lines.append("    " + ", ".join(bins))
+        return "\n".join(lines)
+
+    ## reset
+    #
+    # Discard all recorded latencies.
+    #
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.totals = {}
+
+#
+# The MIT License
+#
+# Copyright (c) 2013 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#